@@ -0,0 +1,344 @@
+"""End-to-end benchmark of the bot against local stand-ins.
+
+    cd bot
+    python -m benchmarks --database-url postgresql+asyncpg://postgres@localhost/postgres \
+            --rate 20 --duration 30 --mix help=2,balance=2,link=1 --output after.json
+    python -m benchmarks ... --output before.json --compare after.json
+
+Fake Telegram Bot API, parser and GigaChat servers run in-process, a throwaway
+database is created on the given Postgres server and dropped afterwards, and
+synthetic updates are fed to the aiogram Dispatcher at a fixed rate. Reports
+p50/p95/p99 handler latency per command, end-to-end analysis latency (link
+sent -> "Готово" delivered) and analyses per second, and saves them as JSON.
+Bot settings (JOB_WORKERS, LLM_MAX_IN_FLIGHT, DB_POOL_SIZE, ...) are read from
+the environment as usual.
+"""
+
+import argparse
+import asyncio
+import collections
+import importlib
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+from benchmarks.fakes import REPORT, create_gigachat_app, create_parser_app, start_app
+from sqlalchemy import make_url, text
+from sqlalchemy.ext.asyncio import create_async_engine
+from tools.fake_telegram import create_api_app, fake_update
+
+COMMANDS = {
+    "start": "/start",
+    "help": "/help",
+    "balance": "/balance",
+    "tokens": "/tokens",
+    "link": None,
+}
+RECORDED_ENV = (
+    "JOB_WORKERS",
+    "LLM_MAX_IN_FLIGHT",
+    "DB_POOL_SIZE",
+    "PARSER_POOL_SIZE",
+    "STREAM_EDIT_INTERVAL",
+    "IDENTITY_CACHE_TTL",
+    "CACHE_TTL_HOURS",
+    "SEND_GLOBAL_RATE",
+    "SEND_CHAT_RATE",
+)
+
+
+def percentiles(values: list):
+    if not values:
+        return {"count": 0}
+    values = sorted(values)
+
+    def rank(p):
+        return values[min(len(values) - 1, int(p / 100 * len(values)))] * 1000
+
+    return {
+        "count": len(values),
+        "p50_ms": round(rank(50), 2),
+        "p95_ms": round(rank(95), 2),
+        "p99_ms": round(rank(99), 2),
+        "max_ms": round(values[-1] * 1000, 2),
+    }
+
+
+def parse_mix(mix: str):
+    weights = {}
+    for item in mix.split(","):
+        name, _, weight = item.partition("=")
+        if name not in COMMANDS:
+            raise SystemExit(f"unknown command in --mix: {name}")
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# Reports sent to a chat are matched to the oldest link still pending there
+class Deliveries:
+    def __init__(self):
+        self.pending = collections.defaultdict(collections.deque)
+        self.latencies = []
+        self.failed = 0
+        self.first_sent = None
+        self.last_done = None
+
+    def sent(self, chat_id: int):
+        now = time.monotonic()
+        self.first_sent = self.first_sent or now
+        self.pending[chat_id].append(now)
+
+    # The outbound sender may join several texts for a chat into one message
+    def on_request(self, method: str, params: dict):
+        for text in (params.get("text") or "").split("\n\n"):
+            if method == "sendMessage" and text.startswith("Готово"):
+                self._done(int(params["chat_id"]), failed=False)
+            elif text.startswith(("Произошла ошибка", "Мы не смогли")):
+                self._done(int(params["chat_id"]), failed=True)
+
+    def _done(self, chat_id: int, failed: bool):
+        if not self.pending[chat_id]:
+            return
+        started = self.pending[chat_id].popleft()
+        self.last_done = time.monotonic()
+        if failed:
+            self.failed += 1
+        else:
+            self.latencies.append(self.last_done - started)
+
+    @property
+    def outstanding(self):
+        return sum(len(queue) for queue in self.pending.values())
+
+
+async def create_database(server_url: str, name: str):
+    engine = create_async_engine(server_url, isolation_level="AUTOCOMMIT")
+    async with engine.connect() as connection:
+        await connection.execute(text(f'CREATE DATABASE "{name}"'))
+    await engine.dispose()
+    return make_url(server_url).set(database=name).render_as_string(False)
+
+
+async def drop_database(server_url: str, name: str):
+    engine = create_async_engine(server_url, isolation_level="AUTOCOMMIT")
+    async with engine.connect() as connection:
+        await connection.execute(text(f'DROP DATABASE IF EXISTS "{name}" WITH (FORCE)'))
+    await engine.dispose()
+
+
+async def run_load(bot_main, args, deliveries: Deliveries):
+    rng = random.Random(args.seed)
+    weights = parse_mix(args.mix)
+    names, cumulative = list(weights), list(itertools.accumulate(weights.values()))
+    users = [1_000_000 + i for i in range(args.users)]
+    for user_id in users:
+        await bot_main.db.create_user(user_id, f"user{user_id}", "Bench", args.plan)
+        await bot_main.db.increase_balance(user_id, 1_000_000)
+
+    latencies = collections.defaultdict(list)
+    errors = collections.Counter()
+    tasks = []
+
+    async def send(update_id: int, command: str, user_id: int, text_: str):
+        if command == "link":
+            deliveries.sent(user_id)
+        started = time.monotonic()
+        try:
+            await bot_main.dp.feed_raw_update(
+                bot_main.bot, fake_update(update_id, user_id, text_)
+            )
+        except Exception as e:
+            print(e)
+            errors[command] += 1
+        latencies[command].append(time.monotonic() - started)
+
+    total = int(args.rate * args.duration)
+    started = time.monotonic()
+    for i in range(total):
+        delay = started + i / args.rate - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        command = rng.choices(names, cum_weights=cumulative)[0]
+        user_id = rng.choice(users)
+        text_ = COMMANDS[command] or f"https://vk.com/id{i % args.profiles}"
+        tasks.append(asyncio.create_task(send(i + 1, command, user_id, text_)))
+    await asyncio.gather(*tasks)
+    sending = time.monotonic() - started
+
+    deadline = time.monotonic() + args.drain_timeout
+    while deliveries.outstanding and time.monotonic() < deadline:
+        await asyncio.sleep(0.1)
+
+    return latencies, errors, sending
+
+
+def build_results(args, latencies, errors, sending, deliveries: Deliveries):
+    analyses = percentiles(deliveries.latencies)
+    elapsed = None
+    if deliveries.latencies:
+        elapsed = deliveries.last_done - deliveries.first_sent
+    analyses.update(
+        failed=deliveries.failed,
+        unfinished=deliveries.outstanding,
+        per_second=round(len(deliveries.latencies) / elapsed, 3) if elapsed else 0,
+    )
+    config = {
+        key: value
+        for key, value in vars(args).items()
+        if key not in ("database_url", "output", "compare")
+    }
+    return {
+        "commit": git_commit(),
+        "started_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "config": config,
+        "env": {key: os.environ[key] for key in RECORDED_ENV if key in os.environ},
+        "updates_per_second": round(sum(map(len, latencies.values())) / sending, 2),
+        "commands": {
+            command: {**percentiles(values), "errors": errors[command]}
+            for command, values in sorted(latencies.items())
+        },
+        "analyses": analyses,
+    }
+
+
+def print_results(results: dict):
+    print(f"commit {results['commit']}, {results['updates_per_second']} updates/s")
+    rows = [(name, stats) for name, stats in results["commands"].items()]
+    rows.append(("analysis", results["analyses"]))
+    for name, stats in rows:
+        if not stats["count"]:
+            continue
+        print(
+            f"{name:>10}: n={stats['count']:<6} p50={stats['p50_ms']:>9.1f}ms "
+            f"p95={stats['p95_ms']:>9.1f}ms p99={stats['p99_ms']:>9.1f}ms"
+        )
+    analyses = results["analyses"]
+    print(
+        f"analyses/s: {analyses['per_second']} "
+        f"(failed {analyses['failed']}, unfinished {analyses['unfinished']})"
+    )
+
+
+def print_comparison(results: dict, baseline: dict):
+    print(f"\nagainst {baseline['commit']} ({baseline['started_at']}):")
+    sections = {**results["commands"], "analysis": results["analyses"]}
+    old_sections = {**baseline["commands"], "analysis": baseline["analyses"]}
+    for name, stats in sections.items():
+        old = old_sections.get(name)
+        if not old or not old["count"] or not stats["count"]:
+            continue
+        changes = " ".join(
+            f"{key[:3]} {(stats[key] - old[key]) / old[key] * 100:+.1f}%"
+            for key in ("p50_ms", "p95_ms", "p99_ms")
+            if old[key]
+        )
+        print(f"{name:>10}: {changes}")
+    old_rate = baseline["analyses"]["per_second"]
+    if old_rate:
+        change = (results["analyses"]["per_second"] - old_rate) / old_rate * 100
+        print(f"analyses/s: {change:+.1f}%")
+
+
+async def benchmark(args):
+    deliveries = Deliveries()
+    runners = []
+    for app in (
+        create_api_app(verbose=False, on_request=deliveries.on_request),
+        create_parser_app(args.posts, args.parser_latency),
+        create_gigachat_app(args.llm_latency, args.llm_output, args.llm_chunk),
+    ):
+        runners.append(await start_app(app))
+    telegram_url, parser_url, gigachat_url = (url for _, url in runners)
+
+    name = f"linklens_bench_{os.getpid()}"
+    os.environ.update(
+        BOT_TOKEN="123456:benchmark",
+        TELEGRAM_API_URL=telegram_url,
+        PARSER_URL=f"{parser_url}/parse",
+        GIGACHAT_BASE_URL=gigachat_url,
+        GIGACHAT_ACCESS_TOKEN="benchmark",
+        DATABASE_URL=await create_database(args.database_url, name),
+        BOT_WORKERS="1",
+    )
+    bot_main = None
+    try:
+        # main and migrate read their settings at import time
+        await importlib.import_module("migrate").migrate()
+        bot_main = importlib.import_module("main")
+        await bot_main.startup()
+        latencies, errors, sending = await run_load(bot_main, args, deliveries)
+    finally:
+        if bot_main is not None:
+            await bot_main.shutdown()
+            await bot_main.bot.session.close()
+            await bot_main.db.engine.dispose()
+        for runner, _ in runners:
+            await runner.cleanup()
+        await drop_database(args.database_url, name)
+
+    return build_results(args, latencies, errors, sending, deliveries)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description=__doc__.splitlines()[0],
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "--database-url",
+        default=os.getenv("BENCHMARK_DATABASE_URL"),
+        help="Postgres server to create the throwaway database on",
+    )
+    parser.add_argument("--rate", type=float, default=20, help="updates per second")
+    parser.add_argument("--duration", type=float, default=10, help="seconds")
+    parser.add_argument("--mix", default="help=2,balance=2,link=1")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--plan", default="person", choices=["person", "corporation"])
+    parser.add_argument(
+        "--profiles",
+        type=int,
+        default=1_000_000,
+        help="distinct VK profiles; fewer profiles than links exercise the cache",
+    )
+    parser.add_argument("--posts", type=int, default=5, help="posts per profile")
+    parser.add_argument("--parser-latency", type=float, default=0.2)
+    parser.add_argument("--llm-latency", type=float, default=2.0)
+    parser.add_argument("--llm-output", default=REPORT)
+    parser.add_argument("--llm-chunk", type=int, default=40, help="stream chunk size")
+    parser.add_argument("--drain-timeout", type=float, default=120)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", default="benchmark.json")
+    parser.add_argument("--compare", help="earlier results JSON to compare with")
+    args = parser.parse_args()
+    if not args.database_url:
+        parser.error("--database-url or BENCHMARK_DATABASE_URL is required")
+
+    results = asyncio.run(benchmark(args))
+    print_results(results)
+    if args.compare:
+        with open(args.compare) as file:
+            print_comparison(results, json.load(file))
+    with open(args.output, "w") as file:
+        json.dump(results, file, ensure_ascii=False, indent=2)
+    print(f"\nsaved to {args.output}")
+
+
+if __name__ == "__main__":
+    sys.exit(main())
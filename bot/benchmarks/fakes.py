@@ -0,0 +1,101 @@
+import asyncio
+import json
+import random
+import time
+import zlib
+
+from aiohttp import web
+
+WORDS = (
+    "сегодня работа команда проект поездка книга спорт музыка семья друзья "
+    "конференция выступление город море горы учёба код релиз встреча идея "
+    "волонтёрство выставка кино бег велосипед фотография путешествие опыт"
+).split()
+
+REPORT = (
+    "Личные качества: коммуникабельность, ответственность, любознательность.\n"
+    "Интересы: путешествия, спорт, профессиональное развитие.\n"
+    "Обратить внимание: не обнаружено."
+)
+
+
+async def start_app(app: web.Application):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    return runner, f"http://127.0.0.1:{runner.addresses[0][1]}"
+
+
+def fake_posts(account: int, count: int, offset: int, total: int):
+    rng = random.Random(account)
+    now = int(time.time())
+    posts = {}
+    for i in range(offset, min(offset + count, total)):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(15, 40))]
+        posts[f"post{i + 1}"] = {"text": " ".join(words), "date": now - i * 86400}
+    return posts
+
+
+# Mimics parser/main.go: the account id is derived from the link
+def create_parser_app(posts: int, latency: float):
+    async def parse(request: web.Request):
+        payload = await request.json()
+        account = zlib.crc32(payload["link"].rstrip("/").encode()) % 10**9
+        count = min(payload.get("count") or 5, 100)
+        offset = payload.get("offset") or 0
+        await asyncio.sleep(latency)
+        result = {
+            "success": f"Success receive data from account: {account}",
+            "total": posts,
+            "posts": fake_posts(account, count, offset, posts),
+        }
+        return web.json_response({"result": json.dumps(result, ensure_ascii=False)})
+
+    app = web.Application()
+    app.router.add_post("/parse", parse)
+    return app
+
+
+# Answers /chat/completions like GigaChat, streaming with the SSE framing the
+# gigachat client expects; latency is spread over the stream
+def create_gigachat_app(latency: float, output: str, chunk_size: int):
+    def completion(body: dict, content: str, delta: bool):
+        prompt = sum(len(message.get("content", "")) for message in body["messages"])
+        choice = {"index": 0, "finish_reason": "stop"}
+        choice["delta" if delta else "message"] = {
+            "role": "assistant",
+            "content": content,
+        }
+        return {
+            "choices": [choice],
+            "created": int(time.time()),
+            "model": "GigaChat",
+            "object": "chat.completion",
+            "usage": {
+                "prompt_tokens": prompt // 3,
+                "completion_tokens": len(output) // 3,
+                "total_tokens": (prompt + len(output)) // 3,
+            },
+        }
+
+    async def chat(request: web.Request):
+        body = await request.json()
+        if not body.get("stream"):
+            await asyncio.sleep(latency)
+            return web.json_response(completion(body, output, False))
+
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+        chunks = [output[i : i + chunk_size] for i in range(0, len(output), chunk_size)]
+        for chunk in chunks:
+            await asyncio.sleep(latency / len(chunks))
+            data = json.dumps(completion(body, chunk, True), ensure_ascii=False)
+            await response.write(f"data: {data}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        await response.write_eof()
+        return response
+
+    app = web.Application()
+    app.router.add_post("/chat/completions", chat)
+    return app
@@ -0,0 +1,107 @@
+import re
+import zlib
+from datetime import datetime, timezone
+
+import metrics
+
+URL = re.compile(r"(https?://|www\.)\S+|\[(?:id|club)\d+\|([^\]]*)\]")
+# Emoji, pictographs, dingbats, variation selectors and joiners
+EMOJI = re.compile(
+    "[\U0001f000-\U0001faff\u2600-\u27bf\u2b00-\u2bff\ufe0f\u200d\u20e3]+"
+)
+SPACES = re.compile(r"\s+")
+WORD = re.compile(r"\w+")
+
+
+def estimate_tokens(text: str, chars_per_token: float):
+    return int(len(text) / chars_per_token) + 1
+
+
+def clean_text(text: str):
+    text = URL.sub(lambda match: match.group(2) or " ", text)
+    text = EMOJI.sub(" ", text)
+    return SPACES.sub(" ", text).strip()
+
+
+def shingles(text: str, size: int = 3):
+    words = WORD.findall(text.lower())
+    if len(words) <= size:
+        return {zlib.crc32(" ".join(words).encode())}
+    return {
+        zlib.crc32(" ".join(words[i : i + size]).encode())
+        for i in range(len(words) - size + 1)
+    }
+
+
+def format_post(text: str, date: int):
+    day = datetime.fromtimestamp(date, timezone.utc).strftime("%Y-%m-%d")
+    return f"{day}: {text}"
+
+
+# Turns the parser's posts into the compact "YYYY-MM-DD: text" lines sent to
+# GigaChat: strips links and emoji, drops empty and near-duplicate posts and
+# keeps the newest posts that fit into the token budget
+class PromptCompactor:
+    def __init__(self, token_budget: int, similarity: float, chars_per_token: float):
+        self.token_budget = token_budget
+        self.similarity = similarity
+        self.chars_per_token = chars_per_token
+
+    def _is_duplicate(self, candidate: set, kept: list):
+        for other in kept:
+            union = len(candidate | other)
+            if union and len(candidate & other) / union >= self.similarity:
+                return True
+        return False
+
+    def clean(self, posts: list):
+        cleaned, kept_shingles = [], []
+        for post in posts:
+            text = clean_text(post.text)
+            if not text:
+                continue
+            post_shingles = shingles(text)
+            if self._is_duplicate(post_shingles, kept_shingles):
+                metrics.compaction_duplicates.inc()
+                continue
+            kept_shingles.append(post_shingles)
+            cleaned.append(post._replace(text=text))
+        return cleaned
+
+    def pack(self, posts: list, token_budget: int = None):
+        budget = self.token_budget if token_budget is None else token_budget
+        budget_chars = int(budget * self.chars_per_token)
+        lines, used = [], 0
+        for post in posts:
+            line = format_post(post.text, post.date)
+            if used + len(line) > budget_chars:
+                remaining = budget_chars - used
+                if remaining > 40:
+                    lines.append(line[: remaining - 1] + "…")
+                break
+            lines.append(line)
+            used += len(line) + 1
+        return "\n".join(lines)
+
+    # Splits the whole cleaned history into consecutive chunks of token_budget
+    def chunk(self, posts: list, token_budget: int):
+        budget_chars = int(token_budget * self.chars_per_token)
+        chunks, lines, used = [], [], 0
+        for post in self.clean(posts):
+            line = format_post(post.text, post.date)[:budget_chars]
+            if lines and used + len(line) > budget_chars:
+                chunks.append("\n".join(lines))
+                lines, used = [], 0
+            lines.append(line)
+            used += len(line) + 1
+        if lines:
+            chunks.append("\n".join(lines))
+        return chunks
+
+    # raw is the payload as it used to be pasted into the prompt, for metrics
+    def compact(self, posts: list, raw: str):
+        data = self.pack(self.clean(posts))
+        before = estimate_tokens(raw, self.chars_per_token)
+        after = estimate_tokens(data, self.chars_per_token)
+        metrics.compaction_saved_tokens.observe(max(before - after, 0))
+        return data
@@ -0,0 +1,6 @@
+from os.path import dirname, join
+
+from dotenv import load_dotenv
+
+# The one place bot/.env is read; modules that read settings import this first
+load_dotenv(join(dirname(__file__), ".env"))
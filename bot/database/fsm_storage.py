@@ -0,0 +1,76 @@
+from datetime import timedelta
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, StorageKey
+from database.models import FSMState
+from sqlalchemy import case, delete, func, select
+from sqlalchemy.dialects.postgresql import insert
+
+
+# FSM storage shared by every bot process through the fsm_states table.
+# Each write is one upsert that also pushes the row's expiry forward.
+class SQLAlchemyStorage(BaseStorage):
+    def __init__(self, db, ttl: int, key_builder=None):
+        self.db = db
+        self.ttl = timedelta(seconds=ttl)
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+
+    async def _upsert(self, key: StorageKey, **values):
+        statement = insert(FSMState).values(
+            key=self.key_builder.build(key),
+            expires_at=func.now() + self.ttl,
+            **{"state": None, "data": {}, **values},
+        )
+        expired = FSMState.expires_at <= func.now()
+        # Columns not being written are kept, unless the row already expired
+        set_ = {
+            name: case(
+                (expired, statement.excluded[name]), else_=FSMState.__table__.c[name]
+            )
+            for name in ("state", "data")
+            if name not in values
+        }
+        set_.update({name: statement.excluded[name] for name in values})
+        set_["expires_at"] = statement.excluded.expires_at
+        async with self.db.session() as session:
+            await session.execute(
+                statement.on_conflict_do_update(
+                    index_elements=[FSMState.key], set_=set_
+                )
+            )
+            await session.commit()
+
+    async def _get(self, key: StorageKey, column):
+        async with self.db.session() as session:
+            return await session.scalar(
+                select(column).where(
+                    FSMState.key == self.key_builder.build(key),
+                    FSMState.expires_at > func.now(),
+                )
+            )
+
+    async def set_state(self, key: StorageKey, state=None):
+        await self._upsert(
+            key, state=state.state if isinstance(state, State) else state
+        )
+
+    async def get_state(self, key: StorageKey):
+        return await self._get(key, FSMState.state)
+
+    async def set_data(self, key: StorageKey, data: dict):
+        await self._upsert(key, data=data)
+
+    async def get_data(self, key: StorageKey):
+        data = await self._get(key, FSMState.data)
+        return dict(data) if data else {}
+
+    async def purge_expired(self):
+        async with self.db.session() as session:
+            result = await session.execute(
+                delete(FSMState).where(FSMState.expires_at <= func.now())
+            )
+            await session.commit()
+            return result.rowcount
+
+    async def close(self):
+        pass
@@ -1,4 +1,21 @@
-from sqlalchemy import BigInteger, Column, Date, ForeignKey, Integer, String
+from sqlalchemy import (
+    JSON,
+    BigInteger,
+    Boolean,
+    Column,
+    Computed,
+    Date,
+    DateTime,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    Text,
+    false,
+    func,
+    text,
+)
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy.ext.asyncio import AsyncAttrs
 from sqlalchemy.orm import DeclarativeBase, relationship
 
@@ -9,6 +26,8 @@ class Base(AsyncAttrs, DeclarativeBase):
 
 class User(Base):
     __tablename__ = "users"
+    # Also serves the keyset pagination of a balance's users
+    __table_args__ = (Index("ix_users_balance_id_id", "balance_id", "id"),)
 
     id = Column(BigInteger, primary_key=True)
     balance_id = Column(Integer, ForeignKey("balances.id"))
@@ -19,10 +38,127 @@ class User(Base):
 
 class Balance(Base):
     __tablename__ = "balances"
+    __table_args__ = (
+        Index("ix_balances_uniq_code", "uniq_code", unique=True),
+        # Keyset scans of the notification scheduler. The low balance scan
+        # only covers balances not warned since their last top-up, so
+        # accounts that stay empty drop out of it.
+        Index("ix_balances_subscription_end_id", "subscription_end", "id"),
+        Index(
+            "ix_balances_low_balance_pending",
+            "amount",
+            "id",
+            postgresql_where=text("NOT low_balance_notified"),
+        ),
+    )
 
     id = Column(Integer, primary_key=True, index=True)
-    owner_id = Column(BigInteger, ForeignKey("users.id"), nullable=False)
+    owner_id = Column(BigInteger, ForeignKey("users.id"), nullable=False, index=True)
     amount = Column(Integer, nullable=False)
     uniq_code = Column(String, nullable=True)
     subscription_end = Column(Date, nullable=True)
+    low_balance_notified = Column(
+        Boolean, nullable=False, default=False, server_default=false()
+    )
     users = relationship("User", backref="balance", foreign_keys=[User.balance_id])
+
+
+class AnalysisJob(Base):
+    __tablename__ = "analysis_jobs"
+    __table_args__ = (Index("ix_analysis_jobs_status_id", "status", "id"),)
+
+    id = Column(Integer, primary_key=True)
+    kind = Column(String, nullable=False, default="profile")
+    user_id = Column(BigInteger, ForeignKey("users.id"), nullable=False)
+    chat_id = Column(BigInteger, nullable=False)
+    payload = Column(JSON, nullable=False)
+    status = Column(String, nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(String, nullable=True)
+    locked_until = Column(DateTime(timezone=True), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(
+        DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
+    )
+
+
+class AnalysisCache(Base):
+    __tablename__ = "analysis_cache"
+
+    vk_id = Column(BigInteger, primary_key=True)
+    posts_digest = Column(String(64), primary_key=True)
+    report = Column(Text, nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_used_at = Column(
+        DateTime(timezone=True), server_default=func.now(), index=True
+    )
+
+
+# Last report per VK profile and the date of the newest post it covers, so a
+# recheck only has to look at posts published since then
+class AnalysisSnapshot(Base):
+    __tablename__ = "analysis_snapshots"
+
+    vk_id = Column(BigInteger, primary_key=True)
+    report = Column(Text, nullable=False)
+    last_post_date = Column(BigInteger, nullable=False)
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+
+# Every delivered report, searchable by the balance that paid for it. search is
+# computed by Postgres from the text, so it never drifts from report.
+class Report(Base):
+    __tablename__ = "reports"
+    __table_args__ = (
+        Index("ix_reports_balance_id_id", "balance_id", "id"),
+        Index("ix_reports_search", "search", postgresql_using="gin"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    vk_id = Column(BigInteger, nullable=True)
+    link = Column(String, nullable=False)
+    kind = Column(String, nullable=False, default="profile")
+    requester_id = Column(BigInteger, ForeignKey("users.id"), nullable=False)
+    balance_id = Column(Integer, ForeignKey("balances.id"), nullable=False)
+    reservation_id = Column(
+        Integer, ForeignKey("credit_reservations.id"), nullable=True, index=True
+    )
+    report = Column(Text, nullable=False)
+    search = Column(TSVECTOR, Computed("to_tsvector('russian', report)"))
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class CreditReservation(Base):
+    __tablename__ = "credit_reservations"
+    __table_args__ = (
+        Index("ix_credit_reservations_status_created_at", "status", "created_at"),
+        Index("ix_credit_reservations_balance_id_id", "balance_id", "id"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    balance_id = Column(Integer, ForeignKey("balances.id"), nullable=False)
+    user_id = Column(BigInteger, ForeignKey("users.id"), nullable=False)
+    amount = Column(Integer, nullable=False)
+    status = Column(String, nullable=False, default="reserved")
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    settled_at = Column(DateTime(timezone=True), nullable=True)
+
+
+# Reminders already sent, one row per balance, kind and key (the subscription
+# end date for "expiry"). The primary key makes sending at most once.
+class Notification(Base):
+    __tablename__ = "notifications"
+
+    balance_id = Column(Integer, ForeignKey("balances.id"), primary_key=True)
+    kind = Column(String, primary_key=True)
+    key = Column(String, primary_key=True, default="")
+    sent_at = Column(DateTime(timezone=True), server_default=func.now())
+
+
+class FSMState(Base):
+    __tablename__ = "fsm_states"
+
+    key = Column(String, primary_key=True)
+    state = Column(String, nullable=True)
+    data = Column(JSONB, nullable=False, default=dict)
+    expires_at = Column(DateTime(timezone=True), nullable=False, index=True)
@@ -0,0 +1,88 @@
+import asyncio
+
+from model import (
+    INSUFFICIENT_DATA,
+    NO_FINDINGS,
+    analyze_profile,
+    merge_summaries,
+    reduce_summaries,
+    summarize_chunk,
+)
+from utils.posts import parse_result, parse_total
+
+
+# Map-reduce analysis of a long wall: the history is fetched in parser pages,
+# split into token-bounded chunks that are summarised concurrently (bounded by
+# the LLM pool), and the notes are folded fan_in at a time into the report.
+# Wall-clock time grows with the depth of the tree, not with the post count.
+class DeepAnalyzer:
+    def __init__(
+        self,
+        parser_client,
+        compactor,
+        page_size: int,
+        max_posts: int,
+        chunk_tokens: int,
+        fan_in: int,
+    ):
+        # A merge has to shrink the notes, or the reduce loop never ends
+        if fan_in < 2:
+            raise RuntimeError("DEEP_FAN_IN must be at least 2")
+        self.parser_client = parser_client
+        self.compactor = compactor
+        self.page_size = page_size
+        self.max_posts = max_posts
+        self.chunk_tokens = chunk_tokens
+        self.fan_in = fan_in
+
+    async def fetch_posts(self, link: str):
+        first = await self.parser_client.parse(link, self.page_size, 0)
+        vk_id, posts = parse_result(first)
+        total = min(parse_total(first), self.max_posts)
+
+        pages = await asyncio.gather(
+            *(
+                self.parser_client.parse(link, self.page_size, offset)
+                for offset in range(self.page_size, total, self.page_size)
+            )
+        )
+        for page in pages:
+            posts.extend(parse_result(page)[1])
+
+        # New posts shift the pages while they are fetched
+        posts = list(dict.fromkeys(posts))
+        posts.sort(key=lambda post: post.date, reverse=True)
+        return vk_id, posts[: self.max_posts]
+
+    async def analyze(self, posts: list, on_progress=None):
+        chunks = self.compactor.chunk(posts, self.chunk_tokens)
+        if not chunks:
+            return INSUFFICIENT_DATA
+        if len(chunks) == 1:
+            return await analyze_profile(chunks[0])
+
+        done = 0
+
+        async def summarize(chunk):
+            nonlocal done
+            summary = await summarize_chunk(chunk)
+            done += 1
+            if on_progress is not None:
+                await on_progress(done, len(chunks))
+            return summary
+
+        summaries = await asyncio.gather(*(summarize(chunk) for chunk in chunks))
+        summaries = [s for s in summaries if s.strip() != NO_FINDINGS]
+        if not summaries:
+            return INSUFFICIENT_DATA
+
+        while len(summaries) > self.fan_in:
+            groups = [
+                summaries[i : i + self.fan_in]
+                for i in range(0, len(summaries), self.fan_in)
+            ]
+            merged = await asyncio.gather(
+                *(merge_summaries(group) for group in groups if len(group) > 1)
+            )
+            summaries = merged + [group[0] for group in groups if len(group) == 1]
+        return await reduce_summaries(summaries)
@@ -1,28 +1,114 @@
 import asyncio
+import multiprocessing
 import os
+import tempfile
+import time
 from datetime import date
-from os.path import dirname, join
+from functools import partial
+from os.path import join
 
-import aiohttp
+import config
+import metrics
 import utils.keyboards as keyboards
 from aiogram import Bot, Dispatcher, F
-from aiogram.filters import Command, CommandStart, or_f
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.filters import Command, CommandObject, CommandStart, or_f
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.types import CallbackQuery, Message
+from aiogram.types import BufferedInputFile, CallbackQuery, FSInputFile, Message
+from compaction import PromptCompactor
 from database.database import Database
-from dotenv import load_dotenv
-from model import analyze_profile
+from database.fsm_storage import SQLAlchemyStorage
+from deep import DeepAnalyzer
+from model import (
+    INSUFFICIENT_DATA,
+    analyze_profile,
+    analyze_profile_stream,
+    is_insufficient,
+    may_be_insufficient,
+    update_profile,
+    update_profile_stream,
+    warm_up,
+)
+from notifications import NotificationScheduler
+from parser_client import ParserClient
+from prescreen import PreScreen
+from profiling import SamplingProfiler
+from server import create_app, setup_webhook, start_server
+from utils.batch import extract_links, results_csv
+from utils.export import write_usage_csv
+from utils.middlewares import (
+    HandlerMetricsMiddleware,
+    IdentityMiddleware,
+    TelegramMetricsMiddleware,
+)
+from utils.posts import parse_result, posts_digest
+from utils.sender import OutboundSender
+from utils.singleflight import SingleFlight, normalize_link
+from utils.streaming import MESSAGE_LIMIT, ThrottledEditor
 from utils.utils import translate_month_in_str
+from worker import JobWorkerPool
 
-dotenv_path = join(dirname(__file__), ".env")
-load_dotenv(dotenv_path)
 TOKEN = os.getenv("BOT_TOKEN")
-bot = Bot(token=TOKEN)
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "4"))
+JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", "5"))
+JOB_LEASE = int(os.getenv("JOB_LEASE", "300"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+CACHE_TTL = int(os.getenv("CACHE_TTL_HOURS", "24")) * 3600
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "10000"))
+CACHE_HIT_COST = int(os.getenv("CACHE_HIT_COST", "1"))
+RESERVATION_TTL = int(os.getenv("RESERVATION_TTL_HOURS", "24")) * 3600
+SNAPSHOT_TTL = int(os.getenv("SNAPSHOT_TTL_DAYS", "180")) * 86400
+PARSER_URL = os.getenv("PARSER_URL", "http://parser:8000/parse")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL")
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+WEB_HOST = os.getenv("WEB_HOST", "0.0.0.0")
+WEB_PORT = int(os.getenv("WEB_PORT", "8000"))
+BOT_WORKERS = int(os.getenv("BOT_WORKERS", "1"))
+FSM_TTL = int(os.getenv("FSM_TTL_HOURS", "24")) * 3600
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.5"))
+DEEP_COST = int(os.getenv("DEEP_COST", "1"))
+BATCH_MAX_LINKS = int(os.getenv("BATCH_MAX_LINKS", "100"))
+BATCH_MAX_FILE_SIZE = int(os.getenv("BATCH_MAX_FILE_SIZE", "1048576"))
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "10"))
+PROFILE_DIR = os.getenv("PROFILE_DIR")
+SEND_GLOBAL_RATE = float(os.getenv("SEND_GLOBAL_RATE", "25"))
+SEND_CHAT_RATE = float(os.getenv("SEND_CHAT_RATE", "1"))
+SEND_CHAT_BURST = int(os.getenv("SEND_CHAT_BURST", "3"))
+SEND_CONCURRENCY = int(os.getenv("SEND_CONCURRENCY", "8"))
+USERS_PAGE_SIZE = int(os.getenv("USERS_PAGE_SIZE", "10"))
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "5"))
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+# Bot API upload limit for documents
+EXPORT_MAX_FILE_SIZE = 50 * 1024 * 1024
+NOTIFY_INTERVAL = float(os.getenv("NOTIFY_INTERVAL", "3600"))
+NOTIFY_BATCH_SIZE = int(os.getenv("NOTIFY_BATCH_SIZE", "500"))
+NOTIFY_EXPIRY_DAYS = int(os.getenv("NOTIFY_EXPIRY_DAYS", "3"))
+NOTIFY_LOW_BALANCE = int(os.getenv("NOTIFY_LOW_BALANCE", "2"))
+
+session = None
+if TELEGRAM_API_URL:
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_URL))
+bot = Bot(token=TOKEN, session=session)
+bot.session.middleware(TelegramMetricsMiddleware())
+# Replies that come in bursts and everything sent from background jobs go
+# through the sender; single replies to a user's message use message.answer
+sender = OutboundSender(
+    bot,
+    global_rate=SEND_GLOBAL_RATE,
+    chat_rate=SEND_CHAT_RATE,
+    chat_burst=SEND_CHAT_BURST,
+    concurrency=SEND_CONCURRENCY,
+)
 
-dp = Dispatcher()
+db = Database(identity_cache=BOT_WORKERS == 1)
 
-db = Database()
+storage = SQLAlchemyStorage(db, FSM_TTL)
+dp = Dispatcher(storage=storage)
 
 
 class Start_Form(StatesGroup):
@@ -32,11 +118,12 @@ class Start_Form(StatesGroup):
 # Command '/start'
 async def command_start_handler(message: Message, state: FSMContext):
     await state.set_state(Start_Form.choice)
-    await message.answer(f"Привет, {message.from_user.first_name}! 👋")
-    await message.answer(
-        "Я — LinkLens, ваш умный помощник HR, который поможет создать профиль человека на основе его активности в социальных сетях. Используя передовые технологии искусственного интеллекта, я анализирую данные, чтобы предоставить вам полезную информацию.\n"
+    sender.post(message.chat.id, f"Привет, {message.from_user.first_name}! 👋")
+    sender.post(
+        message.chat.id,
+        "Я — LinkLens, ваш умный помощник HR, который поможет создать профиль человека на основе его активности в социальных сетях. Используя передовые технологии искусственного интеллекта, я анализирую данные, чтобы предоставить вам полезную информацию.\n",
     )
-    await message.answer("Выберите план", reply_markup=keyboards.choose_plan)
+    sender.post(message.chat.id, "Выберите план", reply_markup=keyboards.choose_plan)
 
 
 @dp.message(Start_Form.choice)
@@ -49,10 +136,13 @@ async def choice_handler(message: Message, state: FSMContext):
             full_name=message.from_user.full_name,
             plan="person",
         )
-        await message.answer(
-            "Вы выбрали план Персональный.", reply_markup=keyboards.person
+        sender.post(
+            message.chat.id,
+            "Вы выбрали план Персональный.",
+            reply_markup=keyboards.person,
         )
-        await message.answer(
+        sender.post(
+            message.chat.id,
             "Купите токены для использования бота.",
             reply_markup=keyboards.choose_tokens,
         )
@@ -63,10 +153,13 @@ async def choice_handler(message: Message, state: FSMContext):
             full_name=message.from_user.full_name,
             plan="corporation",
         )
-        await message.answer(
-            "Вы выбрали план Корпоративный.", reply_markup=keyboards.corporation
+        sender.post(
+            message.chat.id,
+            "Вы выбрали план Корпоративный.",
+            reply_markup=keyboards.corporation,
         )
-        await message.answer(
+        sender.post(
+            message.chat.id,
             "Купите подписку для использования бота.",
             reply_markup=keyboards.subs,
         )
@@ -77,7 +170,7 @@ async def choice_handler(message: Message, state: FSMContext):
 @dp.message(Command("help"))
 async def command_help(message: Message):
     await message.answer(
-        "Список всех комманд: /start - Перезагрузить бота\n/analyze - Обработать профиль\n/balance - Вывести текущий баланс\n/tokens - Купить токены\n/sub - Оформить подписку\nget_code - Получить секретный код\n/send_code - Отправить код\n/help - Вывести все команды"
+        "Список всех комманд: /start - Перезагрузить бота\n/analyze - Обработать профиль\n/deep - Глубокий анализ профиля\nНесколько ссылок в одном сообщении или файл .txt/.csv - Проверить профили списком\n/balance - Вывести текущий баланс\n/tokens - Купить токены\n/sub - Оформить подписку\nget_code - Получить секретный код\n/send_code - Отправить код\n/search - Поиск по отчётам\n/export - Выгрузить историю использования (/export gz - в архиве)\n/help - Вывести все команды"
     )
 
 
@@ -87,9 +180,8 @@ class Form(StatesGroup):
 
 # Command '/send_code'
 @dp.message(or_f(Command("send_code"), F.text == "Прислать секретный код 🙈"))
-async def command_send_code(message: Message, state: FSMContext):
-    user = await db.get_user(user_id=message.from_user.id)
-    if user.plan == "corporation":
+async def command_send_code(message: Message, state: FSMContext, plan: str):
+    if plan == "corporation":
         await state.set_state(Form.code)
         await message.answer("Введите код")
     else:
@@ -98,7 +190,7 @@ async def command_send_code(message: Message, state: FSMContext):
 
 @dp.message(Form.code)
 async def process_code(message: Message, state: FSMContext):
-    balance = await db.get_balance_by_uniq_code(message.text)
+    balance = await db.get_balance_by_uniq_code(message.text.strip().upper())
     if balance:
         await db.link_user_to_balance(message.from_user.id, balance.id)
         await message.answer("Ты успешно привязан к аккаунту")
@@ -111,12 +203,9 @@ async def process_code(message: Message, state: FSMContext):
 
 # Command '/get_code'
 @dp.message(or_f(Command("get_code"), F.text == "Мой секретный код"))
-async def command_create_code(message: Message):
-    user = await db.get_user(user_id=message.from_user.id)
-    if user.plan == "corporation":
-        user = message.from_user
-        await db.create_uniq_code(user.id)
-        uniq_code = await db.get_uniq_code(user.id)
+async def command_create_code(message: Message, plan: str, balance):
+    if plan == "corporation":
+        uniq_code = balance.uniq_code or await db.create_uniq_code(message.from_user.id)
         await message.answer(f"Твой секретный код: {uniq_code}")
     else:
         await message.answer("На вашем плане эта функция не доступна")
@@ -124,9 +213,8 @@ async def command_create_code(message: Message):
 
 # Command '/tokens'
 @dp.message(or_f(Command("tokens"), F.text == "Купить токены 💸"))
-async def command_tokens_handler(message: Message):
-    user = await db.get_user(user_id=message.from_user.id)
-    if user.plan == "person":
+async def command_tokens_handler(message: Message, plan: str):
+    if plan == "person":
         await message.answer(
             "Выберите количество токенов, которое вы хотите приобрести.",
             reply_markup=keyboards.choose_tokens,
@@ -151,20 +239,18 @@ async def tokens_callback_handler(callback_query: CallbackQuery):
 async def update_balance_and_notify(callback_query: CallbackQuery, amount: int):
     await db.increase_balance(callback_query.from_user.id, amount)
 
-    await callback_query.message.answer(
-        f"Баланс успешно пополнен на {amount} токенов! 🎉"
-    )
-    await callback_query.message.answer(
-        f"Теперь вы можете использовать их, воспользовавшись командой /analyze, или просто отправьте ссылку на профиль VK. 🔍"
+    chat_id = callback_query.message.chat.id
+    sender.post(chat_id, f"Баланс успешно пополнен на {amount} токенов! 🎉")
+    sender.post(
+        chat_id,
+        f"Теперь вы можете использовать их, воспользовавшись командой /analyze, или просто отправьте ссылку на профиль VK. 🔍",
     )
 
 
 # Command /sub
 @dp.message(or_f(Command("sub"), F.text == "Оформить подписку ✅"))
-async def command_sub_handler(message: Message):
-    user = await db.get_user(user_id=message.from_user.id)
-    if user.plan == "corporation":
-        balance = await db.get_balance(user_id=message.from_user.id)
+async def command_sub_handler(message: Message, plan: str, balance):
+    if plan == "corporation":
         if balance.owner_id == message.from_user.id:
             await message.answer(
                 "Выберите подписку, которую вы хотите приобрести.",
@@ -178,25 +264,36 @@ async def command_sub_handler(message: Message):
         await message.answer("На вашем плане эта функция не доступна")
 
 
-async def sub_callback_handler(callback_query: CallbackQuery):
+async def sub_callback_handler(callback_query: CallbackQuery, balance):
     callback_data = {"1_month": (1, "m"), "3_month": (3, "m"), "1_year": (1, "y")}
 
     amount = callback_data.get(callback_query.data)
-    await subscribe_and_notify(callback_query, amount[0], amount[1])
+    await subscribe_and_notify(callback_query, balance, amount[0], amount[1])
 
 
-async def subscribe_and_notify(callback_query: CallbackQuery, amount: int, unit: str):
-    balance = await db.get_balance(user_id=callback_query.from_user.id)
+async def subscribe_and_notify(
+    callback_query: CallbackQuery, balance, amount: int, unit: str
+):
     subscription_date = balance.subscription_end
+    if not subscription_date or subscription_date < date.today():
+        if await db.subscribe(callback_query.from_user.id, amount, unit):
+            await callback_query.message.answer(
+                f'Вы успешно подписаны! Попробуйте отправить ссылку на профиль VK, или нажмите на кнопку "Анализ 🔎"'
+            )
+            return
+        # The balance we were given is outdated: the subscription was bought
+        # in the meantime
+        _, balance = await db.get_user_with_balance(callback_query.from_user.id)
+        subscription_date = balance.subscription_end if balance else None
+
     if subscription_date and subscription_date >= date.today():
         date_formatted = translate_month_in_str(subscription_date)
         await callback_query.message.answer(
             f"У вас уже есть подписка. Она действует до {date_formatted}"
         )
     else:
-        await db.subscribe(callback_query.from_user.id, amount, unit)
         await callback_query.message.answer(
-            f'Вы успешно подписаны! Попробуйте отправить ссылку на профиль VK, или нажмите на кнопку "Анализ 🔎"'
+            "Не удалось оформить подписку. 😟 Попробуйте еще раз позже."
         )
 
 
@@ -204,58 +301,454 @@ async def subscribe_and_notify(callback_query: CallbackQuery, amount: int, unit:
 @dp.message(
     or_f(Command("balance"), F.text == "Баланс 💰", F.text == "Проверить подписку 💰")
 )
-async def command_balance(message: Message):
-    user_balance = await db.get_balance(user_id=message.from_user.id)
-    subscription_date = user_balance.subscription_end
+async def command_balance(message: Message, balance):
+    subscription_date = balance.subscription_end
     if subscription_date and subscription_date >= date.today():
         date_formatted = translate_month_in_str(subscription_date)
         await message.answer(f"У вас действует подписка до {date_formatted}")
     else:
-        await message.answer(f"Ваш текущий баланс: {user_balance.amount} токенов.")
+        await message.answer(f"Ваш текущий баланс: {balance.amount} токенов.")
+
+
+parser_client = ParserClient(
+    PARSER_URL,
+    pool_size=int(os.getenv("PARSER_POOL_SIZE", "20")),
+    connect_timeout=float(os.getenv("PARSER_CONNECT_TIMEOUT", "3")),
+    read_timeout=float(os.getenv("PARSER_READ_TIMEOUT", "30")),
+    retries=int(os.getenv("PARSER_RETRIES", "2")),
+    backoff=float(os.getenv("PARSER_BACKOFF", "0.5")),
+    breaker_threshold=int(os.getenv("PARSER_BREAKER_THRESHOLD", "5")),
+    breaker_reset=float(os.getenv("PARSER_BREAKER_RESET", "30")),
+)
+prescreen = PreScreen(
+    min_posts=int(os.getenv("PRESCREEN_MIN_POSTS", "1")),
+    min_text_chars=int(os.getenv("PRESCREEN_MIN_TEXT_CHARS", "80")),
+    max_repost_ratio=float(os.getenv("PRESCREEN_MAX_REPOST_RATIO", "0.8")),
+    min_letter_ratio=float(os.getenv("PRESCREEN_MIN_LETTER_RATIO", "0.5")),
+)
+compactor = PromptCompactor(
+    token_budget=int(os.getenv("PROMPT_TOKEN_BUDGET", "1500")),
+    similarity=float(os.getenv("PROMPT_DEDUP_SIMILARITY", "0.8")),
+    chars_per_token=float(os.getenv("PROMPT_CHARS_PER_TOKEN", "3")),
+)
+deep_analyzer = DeepAnalyzer(
+    parser_client,
+    compactor,
+    page_size=int(os.getenv("DEEP_PAGE_SIZE", "100")),
+    max_posts=int(os.getenv("DEEP_MAX_POSTS", "300")),
+    chunk_tokens=int(os.getenv("DEEP_CHUNK_TOKENS", "2000")),
+    fan_in=int(os.getenv("DEEP_FAN_IN", "8")),
+)
+parse_flights = SingleFlight()
+analysis_flights = SingleFlight()
 
 
-# vk profile link handler
-@dp.message(F.text.regexp(r"https://vk\.com/[A-Za-z0-9]+"))
-async def vk_profile_link_hanldler(message: Message):
-    text = message.text
-    user = message.from_user
-    balance = await db.get_balance(user_id=user.id)
-    if balance.amount > 0 or (
-        balance.subscription_end and balance.subscription_end >= date.today()
-    ):
-        try:
-            await message.answer(
-                "Обрабатываем профиль, пожалуйста, подождите немного... ⏳"
+# Streams the report into on_progress, holding back text that may still turn
+# out to be the "not enough data" answer. With a previous report only the new
+# posts are sent and the model updates that report.
+async def generate_report(data: str, on_progress=None, previous: str = None):
+    if on_progress is None:
+        if previous is not None:
+            return await update_profile(previous, data)
+        return await analyze_profile(data)
+
+    if previous is not None:
+        stream = update_profile_stream(previous, data)
+    else:
+        stream = analyze_profile_stream(data)
+    report = ""
+    async for report in stream:
+        if not may_be_insufficient(report):
+            await on_progress(report)
+    return report
+
+
+async def analyze_posts(vk_id: int, digest: str, generate, data, on_progress=None):
+    report = await db.get_cached_analysis(vk_id, digest, CACHE_TTL)
+    if report is not None:
+        return report, True
+
+    report = await generate(data, on_progress)
+    await db.store_cached_analysis(vk_id, digest, report, CACHE_TTL, CACHE_MAX_ENTRIES)
+    return report, False
+
+
+# Parse the profile and analyze it, skipping the LLM for profiles that are too
+# thin and reusing the report if the posts are unchanged. A profile analysed
+# before is only rechecked against the posts published since its snapshot.
+# Concurrent requests for the same link or the same resolved profile share one
+# parser call and one LLM call; only the first caller sees streamed progress.
+# Returns the report, whether it was reused, and the VK id if known.
+async def analyze_link(link: str, on_progress=None):
+    result = await parse_flights.do(normalize_link(link), parser_client.parse, link)
+    vk_id, posts = parse_result(result)
+    if prescreen.check(posts):
+        return INSUFFICIENT_DATA, False, vk_id
+    if vk_id is None:
+        return (
+            await generate_report(compactor.compact(posts, result), on_progress),
+            False,
+            None,
+        )
+
+    generate, new_posts = generate_report, posts
+    snapshot = await db.get_snapshot(vk_id)
+    if snapshot is not None:
+        new_posts = [post for post in posts if post.date > snapshot.last_post_date]
+        if not new_posts:
+            return snapshot.report, True, vk_id
+        generate = partial(generate_report, previous=snapshot.report)
+
+    digest = posts_digest(posts)
+    report, cached = await analysis_flights.do(
+        (vk_id, digest),
+        analyze_posts,
+        vk_id,
+        digest,
+        generate,
+        compactor.compact(new_posts, result),
+        on_progress,
+    )
+    if not cached and not is_insufficient(report):
+        await db.store_snapshot(vk_id, report, posts[0].date)
+    return report, cached, vk_id
+
+
+# Same as analyze_link for the deep mode: the whole history goes through the
+# map-reduce analyzer, on_progress receives the number of summarised chunks
+async def deep_analyze_link(link: str, on_progress=None):
+    vk_id, posts = await parse_flights.do(
+        ("deep", normalize_link(link)), deep_analyzer.fetch_posts, link
+    )
+    if prescreen.check(posts):
+        return INSUFFICIENT_DATA, False, vk_id
+    if vk_id is None:
+        return await deep_analyzer.analyze(posts, on_progress), False, None
+
+    digest = posts_digest(posts, "deep")
+    report, cached = await analysis_flights.do(
+        (vk_id, digest),
+        analyze_posts,
+        vk_id,
+        digest,
+        deep_analyzer.analyze,
+        posts,
+        on_progress,
+    )
+    return report, cached, vk_id
+
+
+# Background job: stream the report into the "processing" message, then settle
+# the token reserved by the link handler
+async def process_analysis_job(job):
+    chat_id = job.chat_id
+    reservation_id = job.payload["reservation_id"]
+    editor = ThrottledEditor(
+        bot, chat_id, job.payload["message_id"], STREAM_EDIT_INTERVAL
+    )
+
+    async def report_chunks(done: int, total: int):
+        await editor.update(
+            f"Анализируем историю постов: обработано фрагментов {done} из {total}... ⏳"
+        )
+
+    try:
+        if job.kind == "deep":
+            analyze, cached, vk_id = await deep_analyze_link(
+                job.payload["link"], report_chunks
+            )
+        else:
+            analyze, cached, vk_id = await analyze_link(
+                job.payload["link"], editor.update
             )
-            async with aiohttp.ClientSession() as session:
-                response = await session.post(
-                    url="http://parser:8000/parse", json={"link": text}
-                )
-            response.raise_for_status()
-            json = await response.json()
-            analyze = await analyze_profile(json["result"])
-            if analyze == "Недостаточно данных о пользователе.":
-                await message.answer(
-                    "Мы не смогли найти достаточно информации о профиле. 😕 \nНе волнуйтесь, токен за эту попытку не был списан. Попробуйте отправить другую ссылку. 🔗"
-                )
+        if is_insufficient(analyze):
+            await db.release_reservation(reservation_id)
+            await editor.finish(
+                "Мы не смогли найти достаточно информации о профиле. 😕 \nНе волнуйтесь, токен за эту попытку не был списан. Попробуйте отправить другую ссылку. 🔗"
+            )
+            return
+
+        await editor.finish(analyze)
+        charged = await db.commit_reservation(
+            reservation_id, CACHE_HIT_COST if cached else None
+        )
+        await notify_charged(chat_id, charged, cached)
+        await store_report(job, job.payload["link"], vk_id, analyze)
+
+    except Exception as e:
+        print(e)
+        await db.release_reservation(reservation_id)
+        sender.post(
+            chat_id,
+            "Произошла ошибка при обработке ссылки. 😟\nПожалуйста, попробуйте ещё раз.",
+        )
+
+
+# The report is already delivered, so a failure here is only logged
+async def store_report(job, link: str, vk_id: int, report: str):
+    try:
+        await db.store_report(
+            job.payload["reservation_id"], job.user_id, link, vk_id, job.kind, report
+        )
+    except Exception as e:
+        print(e)
+
+
+async def notify_charged(chat_id: int, charged: int, cached: bool):
+    if charged == 1:
+        sender.post(chat_id, "Готово! С вашего баланса успешно списан 1 токен. ✅")
+    elif charged:
+        sender.post(
+            chat_id,
+            f"Готово! С вашего баланса успешно списано токенов: {charged}. ✅",
+        )
+    elif cached:
+        sender.post(chat_id, "Готово! Отчёт взят из сохранённых, токен не списан. ✅")
+    else:
+        sender.post(chat_id, "Готово! ✅")
+
+
+# Background job for a batch of links: one token per link was reserved up
+# front, each link is billed like a single analysis and the rest is refunded
+async def process_batch_job(job):
+    chat_id = job.chat_id
+    links = job.payload["links"]
+    reservation_id = job.payload["reservation_id"]
+    editor = ThrottledEditor(
+        bot, chat_id, job.payload["message_id"], STREAM_EDIT_INTERVAL
+    )
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+    rows = [None] * len(links)
+    costs = [0] * len(links)
+    done = 0
+
+    async def screen(index: int, link: str):
+        nonlocal done
+        async with semaphore:
+            try:
+                report, cached, vk_id = await analyze_link(link)
+            except Exception as e:
+                print(e)
+                rows[index] = (link, "ошибка", "")
             else:
-                await message.answer(analyze)
-                await db.decrease_balance(user.id)
-                await message.answer(
-                    "Готово! С вашего баланса успешно списан 1 токен. ✅"
-                )
+                if is_insufficient(report):
+                    rows[index] = (link, "недостаточно данных", "")
+                elif cached:
+                    rows[index] = (link, "из сохранённых", report)
+                    costs[index] = CACHE_HIT_COST
+                else:
+                    rows[index] = (link, "готово", report)
+                    costs[index] = 1
+                if costs[index]:
+                    await store_report(job, link, vk_id, report)
+        done += 1
+        await editor.update(f"Обработано профилей: {done} из {len(links)}... ⏳")
+
+    try:
+        await asyncio.gather(*(screen(i, link) for i, link in enumerate(links)))
+        await editor.finish(
+            f"Обработано профилей: {len(links)}. Результаты — в файле ниже. 📄"
+        )
+        await bot.send_document(
+            chat_id, BufferedInputFile(results_csv(rows), filename="screening.csv")
+        )
+        charged = await db.commit_reservation(reservation_id, sum(costs))
+        await notify_charged(chat_id, charged, False)
+
+    except Exception as e:
+        print(e)
+        await db.release_reservation(reservation_id)
+        sender.post(
+            chat_id,
+            "Произошла ошибка при обработке списка ссылок. 😟\nПожалуйста, попробуйте ещё раз.",
+        )
 
+
+job_handlers = {
+    "profile": process_analysis_job,
+    "deep": process_analysis_job,
+    "batch": process_batch_job,
+}
+
+
+async def process_job(job):
+    started = time.monotonic()
+    status = "error"
+    metrics.analyses_in_flight.labels(job.kind).inc()
+    try:
+        await job_handlers[job.kind](job)
+        status = "ok"
+    finally:
+        metrics.analyses_in_flight.labels(job.kind).dec()
+        metrics.analyses.labels(job.kind, status).observe(time.monotonic() - started)
+
+
+async def run_maintenance():
+    while True:
+        try:
+            await db.release_expired_reservations(RESERVATION_TTL)
+            await db.purge_snapshots(SNAPSHOT_TTL)
+            await db.purge_notifications((NOTIFY_EXPIRY_DAYS + 30) * 86400)
+            await storage.purge_expired()
         except Exception as e:
             print(e)
-            await message.answer(
-                "Произошла ошибка при обработке ссылки. 😟\nПожалуйста, попробуйте ещё раз."
-            )
-    else:
+        await asyncio.sleep(3600)
+
+
+notifier = NotificationScheduler(
+    db,
+    sender,
+    interval=NOTIFY_INTERVAL,
+    batch_size=NOTIFY_BATCH_SIZE,
+    expiry_days=NOTIFY_EXPIRY_DAYS,
+    low_balance=NOTIFY_LOW_BALANCE,
+)
+
+
+# The job kept dying or timing out, so its handler never told the user
+async def report_exhausted_job(job):
+    await db.release_reservation(job.payload["reservation_id"])
+    sender.post(
+        job.chat_id,
+        "Произошла ошибка при обработке ссылки. 😟\nПожалуйста, попробуйте ещё раз.",
+    )
+
+
+job_workers = JobWorkerPool(
+    db,
+    process_job,
+    report_exhausted_job,
+    concurrency=JOB_WORKERS,
+    poll_interval=JOB_POLL_INTERVAL,
+    lease=JOB_LEASE,
+    max_attempts=JOB_MAX_ATTEMPTS,
+)
+
+
+# Reserves cost tokens, sends the progress message the job will edit and
+# queues the job. Returns False when the balance cannot cover cost.
+async def reserve_and_enqueue(
+    message: Message, kind: str, payload: dict, cost: int, progress_text: str
+):
+    user = message.from_user
+    reservation_id = await db.reserve_credits(user.id, cost)
+    if not reservation_id:
+        return False
+    try:
+        # The job edits the progress message, so it is never merged
+        progress = await sender.send(message.chat.id, progress_text, coalesce=False)
+        await db.enqueue_job(
+            user.id,
+            message.chat.id,
+            {
+                **payload,
+                "reservation_id": reservation_id,
+                "message_id": progress.message_id,
+            },
+            kind,
+        )
+    except Exception:
+        await db.release_reservation(reservation_id)
+        raise
+    job_workers.notify()
+    return True
+
+
+async def enqueue_analysis(message: Message, link: str, kind: str, cost: int):
+    if not await reserve_and_enqueue(
+        message,
+        kind,
+        {"link": link},
+        cost,
+        "Обрабатываем профиль, пожалуйста, подождите немного... ⏳",
+    ):
+        sender.post(
+            message.chat.id,
+            "Упс! Кажется, у вас не хватает токенов. 😅 Пожалуйста, пополните баланс через команду /tokens.",
+        )
+
+
+async def enqueue_batch(message: Message, links: list):
+    if not links:
+        sender.post(message.chat.id, "Не нашли ни одной ссылки на профиль VK. 😟")
+        return
+    if len(links) > BATCH_MAX_LINKS:
+        sender.post(
+            message.chat.id,
+            f"Слишком много ссылок: {len(links)}. За один раз можно проверить не больше {BATCH_MAX_LINKS} профилей.",
+        )
+        return
+
+    if not await reserve_and_enqueue(
+        message,
+        "batch",
+        {"links": links},
+        len(links),
+        f"Принято ссылок: {len(links)}. Обрабатываем профили, пожалуйста, подождите... ⏳",
+    ):
+        sender.post(
+            message.chat.id,
+            f"Упс! Для проверки {len(links)} профилей нужно {len(links)} токенов. 😅 Пожалуйста, пополните баланс через команду /tokens.",
+        )
+
+
+# Several links in one message are screened as a batch
+@dp.message(F.text.func(lambda text: len(extract_links(text)) > 1))
+async def batch_links_handler(message: Message):
+    await enqueue_batch(message, extract_links(message.text))
+
+
+# A .txt or .csv document with links
+@dp.message(F.document.file_name.lower().endswith((".txt", ".csv")))
+async def batch_document_handler(message: Message):
+    if message.document.file_size > BATCH_MAX_FILE_SIZE:
+        await message.answer("Файл слишком большой. 😟")
+        return
+
+    file = await bot.download(message.document)
+    await enqueue_batch(
+        message, extract_links(file.read().decode("utf-8-sig", errors="replace"))
+    )
+
+
+# Registered before the link handler so a link sent in this state is not
+# taken for a regular analysis
+class Deep_Form(StatesGroup):
+    link = State()
+
+
+# Command '/deep': map-reduce analysis of the whole wall, corporate plan only
+@dp.message(or_f(Command("deep"), F.text == "Глубокий анализ 🔬"))
+async def deep_handler(message: Message, state: FSMContext, plan: str):
+    if plan == "corporation":
+        await state.set_state(Deep_Form.link)
         await message.answer(
-            "Упс! Кажется, у вас не хватает токенов. 😅 Пожалуйста, пополните баланс через команду /tokens."
+            "Пришлите ссылку на профиль VK. 🔗\nМы проанализируем всю историю постов, это займёт больше времени."
+        )
+    else:
+        await message.answer("На вашем плане эта функция не доступна")
+
+
+# Commands are left to their handlers, so /cancel leaves this state
+@dp.message(Deep_Form.link, F.text, ~F.text.startswith("/"))
+async def process_deep_link(message: Message, state: FSMContext):
+    if message.text.startswith("https://vk.com/"):
+        await state.clear()
+        await enqueue_analysis(message, message.text, "deep", DEEP_COST)
+    else:
+        await state.set_state(Deep_Form.link)
+        sender.post(message.chat.id, "Не похоже на ссылку на профиль VK. 😟")
+        sender.post(
+            message.chat.id, "Попробуйте еще раз, либо отправьте команду /cancel"
         )
 
 
+# vk profile link handler
+@dp.message(F.text.regexp(r"https://vk\.com/[A-Za-z0-9]+"))
+async def vk_profile_link_hanldler(message: Message):
+    await enqueue_analysis(message, message.text, "profile", 1)
+
+
 class Analyze_Form(StatesGroup):
     link = State()
 
@@ -284,60 +777,224 @@ async def process_link(message: Message, state: FSMContext):
         await vk_profile_link_hanldler(message)
     else:
         await state.set_state(Analyze_Form.link)
-        await message.answer("Не похоже на ссылку на профиль VK. 😟")
-        await message.answer("Попробуйте еще раз, либо отправьте команду /cancel")
+        sender.post(message.chat.id, "Не похоже на ссылку на профиль VK. 😟")
+        sender.post(
+            message.chat.id, "Попробуйте еще раз, либо отправьте команду /cancel"
+        )
 
 
 @dp.message(or_f(Command("users"), F.text == "Привязанные пользователи 👤"))
-async def users_handler(message: Message):
-    user = await db.get_user(user_id=message.from_user.id)
-    if user.plan == "corporation":
-        user_id = message.from_user.id
-
-        balance = await db.get_balance(user_id=user_id)
+async def users_handler(message: Message, plan: str, balance):
+    if plan == "corporation":
         if not balance:
             await message.answer("Баланс не найден.")
             return
 
-        users = await db.get_users_by_balance(balance_id=balance.id)
-        users = [user for user in users if user.id != user_id]
-
-        if not users:
+        keyboard = await users_page(balance)
+        if keyboard is None:
             await message.answer(
                 "Нет других пользователей, привязанных к вашему балансу."
             )
             return
 
-        keyboard = await keyboards.users(users)
-
         await message.answer(
-            "Вот список пользователей, которые подключены к вашему балансу\nНажмите на пользователя, которого хотите удалить со своего аккаунта",
+            "Вот список пользователей, которые подключены к вашему балансу\nОтметьте пользователей, которых хотите удалить со своего аккаунта, и нажмите «Отвязать выбранных»",
             reply_markup=keyboard,
         )
     else:
         await message.answer("На вашем плане эта функция не доступна")
 
 
-async def users_callback_handler(callback_query: CallbackQuery):
-    user_id_to_delete = callback_query.data[len("delete_") :]
-    balance = await db.get_balance(user_id=callback_query.from_user.id)
+# Keyset pages: each costs one index range scan however many users are linked
+async def users_page(balance, after: int = None, before: int = None):
+    users, more = await db.get_linked_users(
+        balance, USERS_PAGE_SIZE, after=after, before=before
+    )
+    if not users:
+        return None
+    if before is not None:
+        return keyboards.users_page(users, has_prev=more, has_next=True)
+    return keyboards.users_page(users, has_prev=after is not None, has_next=more)
+
+
+# Callbacks 'users:toggle:<id>', 'users:next:<id>', 'users:prev:<id>' and
+# 'users:unlink' from the /users page
+async def users_callback_handler(callback_query: CallbackQuery, plan: str, balance):
+    message = callback_query.message
+    _, action, *argument = callback_query.data.split(":")
+    if plan != "corporation" or not balance:
+        await callback_query.answer("На вашем плане эта функция не доступна")
+        return
 
-    if balance.owner_id == callback_query.from_user.id:
-        try:
-            await db.unlink_user_from_balance(int(user_id_to_delete))
-            await callback_query.message.answer(
-                f"Пользователь {user_id_to_delete} удален с вашего баланса."
+    if action == "toggle":
+        await message.edit_reply_markup(
+            reply_markup=keyboards.toggle_user(message.reply_markup, int(argument[0]))
+        )
+    elif action in ("next", "prev"):
+        anchor = int(argument[0])
+        if action == "next":
+            keyboard = await users_page(balance, after=anchor)
+        else:
+            keyboard = await users_page(balance, before=anchor)
+        # The neighbouring page may have been unlinked meanwhile
+        keyboard = keyboard or await users_page(balance)
+        if keyboard is None:
+            await message.edit_text(
+                "Нет других пользователей, привязанных к вашему балансу."
             )
+        else:
+            await message.edit_reply_markup(reply_markup=keyboard)
+    elif action == "unlink":
+        if balance.owner_id != callback_query.from_user.id:
+            await callback_query.answer(
+                "Вы не можете удалять пользователей, привязанных к чужому балансу.",
+                show_alert=True,
+            )
+            return
+        user_ids = keyboards.selected_users(message.reply_markup)
+        if not user_ids:
+            await callback_query.answer("Сначала отметьте пользователей.")
+            return
+        try:
+            unlinked = await db.unlink_users(balance, user_ids)
         except Exception as e:
             print(e)
-            await callback_query.message.answer(
-                "Произошла ошибка при удалении пользователя"
+            await callback_query.answer("Произошла ошибка при удалении пользователей")
+            return
+        await message.answer(
+            f"Удалено пользователей с вашего баланса: {len(unlinked)}."
+        )
+        keyboard = await users_page(balance)
+        if keyboard is None:
+            await message.edit_text(
+                "Нет других пользователей, привязанных к вашему балансу."
             )
+        else:
+            await message.edit_reply_markup(reply_markup=keyboard)
+    await callback_query.answer()
+
 
+class Search_Form(StatesGroup):
+    query = State()
+
+
+# Command '/search': full-text search over the reports paid for by the caller's
+# balance, e.g. "/search агрессия"
+@dp.message(or_f(Command("search"), F.text == "Поиск по отчётам 🗂"))
+async def search_handler(
+    message: Message,
+    state: FSMContext,
+    plan: str,
+    balance,
+    command: CommandObject = None,
+):
+    if plan != "corporation" or not balance:
+        await message.answer("На вашем плане эта функция не доступна")
+    elif command is not None and command.args:
+        await run_search(message, state, balance, command.args)
     else:
-        await callback_query.message.answer(
-            "Вы не можете удалять пользователей, привязанных к чужому балансу."
+        await state.set_state(Search_Form.query)
+        await message.answer(
+            "Что ищем в отчётах? 🔍 Например: агрессия, конфликты, волонтёрство"
+        )
+
+
+@dp.message(Search_Form.query)
+async def process_search_query(message: Message, state: FSMContext, balance):
+    await state.set_state(None)
+    await run_search(message, state, balance, message.text or "")
+
+
+# The query stays in FSM data for the "next page" button
+async def run_search(message: Message, state: FSMContext, balance, query: str):
+    query = query.strip()[:200]
+    await state.update_data(search_query=query)
+    text, keyboard = await search_page(balance, query)
+    await message.answer(text, reply_markup=keyboard)
+
+
+async def search_page(balance, query: str, before: int = None):
+    reports, more = await db.search_reports(
+        balance.id, query, SEARCH_PAGE_SIZE, before=before
+    )
+    if not reports:
+        return f"По запросу «{query}» ничего не нашлось. 😕", None
+    lines = [f"Отчёты по запросу «{query}»:"]
+    for report in reports:
+        lines.append(
+            f"#{report.id} · {translate_month_in_str(report.created_at)} · {report.link}\n{report.snippet}"
+        )
+    return "\n\n".join(lines)[:MESSAGE_LIMIT], keyboards.search_results(reports, more)
+
+
+# Callbacks 'search:open:<id>' and 'search:next:<id>' from the results
+async def search_callback_handler(
+    callback_query: CallbackQuery, state: FSMContext, plan: str, balance
+):
+    _, action, argument = callback_query.data.split(":")
+    if plan != "corporation" or not balance:
+        await callback_query.answer("На вашем плане эта функция не доступна")
+        return
+
+    if action == "open":
+        report = await db.get_report(balance.id, int(argument))
+        if report is None:
+            await callback_query.answer("Отчёт не найден.")
+            return
+        sender.post(
+            callback_query.message.chat.id,
+            f"Отчёт #{report.id} · {report.link}\n\n{report.report}"[:MESSAGE_LIMIT],
         )
+    elif action == "next":
+        query = (await state.get_data()).get("search_query")
+        if not query:
+            await callback_query.answer("Повторите поиск командой /search")
+            return
+        text, keyboard = await search_page(balance, query, before=int(argument))
+        await callback_query.message.edit_text(text, reply_markup=keyboard)
+    await callback_query.answer()
+
+
+# Command '/export': CSV of who used the balance and what it cost, streamed
+# from Postgres to a temporary file; '/export gz' sends it gzipped
+@dp.message(Command("export"))
+async def export_handler(message: Message, plan: str, balance, command: CommandObject):
+    if plan != "corporation" or not balance:
+        await message.answer("На вашем плане эта функция не доступна")
+        return
+    if balance.owner_id != message.from_user.id:
+        await message.answer(
+            "Только создатель секретного кода может выгружать историю использования. 🔐"
+        )
+        return
+
+    compress = (command.args or "").strip().lower() in ("gz", "gzip")
+    filename = "usage.csv.gz" if compress else "usage.csv"
+    await bot.send_chat_action(message.chat.id, "upload_document")
+    with tempfile.TemporaryDirectory() as directory:
+        path = join(directory, filename)
+        try:
+            count = await write_usage_csv(
+                db.stream_usage(balance.id, EXPORT_BATCH_SIZE), path, compress
+            )
+        except Exception as e:
+            print(e)
+            await message.answer("Произошла ошибка при выгрузке. 😟")
+            return
+
+        if not count:
+            await message.answer(
+                "Пока нечего выгружать: анализов по вашему балансу ещё не было."
+            )
+        elif os.path.getsize(path) > EXPORT_MAX_FILE_SIZE:
+            await message.answer(
+                "Файл получился слишком большим для Telegram. 😟 Попробуйте /export gz."
+            )
+        else:
+            await message.answer_document(
+                FSInputFile(path, filename=filename),
+                caption=f"История использования: заявок {count}. 📄",
+            )
 
 
 def register_handlers(dp: Dispatcher):
@@ -349,16 +1006,130 @@ def register_handlers(dp: Dispatcher):
     dp.callback_query.register(
         sub_callback_handler, lambda c: c.data in ["1_month", "3_month", "1_year"]
     )
-    dp.callback_query.register(
-        users_callback_handler, lambda c: c.data.startswith("delete_")
+    dp.callback_query.register(users_callback_handler, F.data.startswith("users:"))
+    dp.callback_query.register(search_callback_handler, F.data.startswith("search:"))
+
+
+async def run_webhook(worker: int):
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        raise RuntimeError(
+            "WEBHOOK_URL and WEBHOOK_SECRET are required in webhook mode"
+        )
+
+    app = create_app(is_ready)
+    setup_webhook(app, dp, bot, WEBHOOK_PATH, WEBHOOK_SECRET)
+    runner = await start_server(app, WEB_HOST, WEB_PORT, reuse_port=BOT_WORKERS > 1)
+    try:
+        if worker == 0:
+            await bot.set_webhook(
+                f"{WEBHOOK_URL}{WEBHOOK_PATH}",
+                secret_token=WEBHOOK_SECRET,
+                allowed_updates=dp.resolve_used_update_types(),
+            )
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+# Profiling is off unless PROFILE_DIR is set; when off nothing is installed
+profiler = None
+if PROFILE_DIR:
+    profiler = SamplingProfiler(
+        PROFILE_DIR,
+        interval=float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "10")) / 1000,
+        dump_interval=float(os.getenv("PROFILE_DUMP_INTERVAL", "300")),
+        lag_threshold=float(os.getenv("PROFILE_LAG_THRESHOLD_MS", "100")) / 1000,
     )
 
+# Set once startup has registered the handlers and started the background work
+ready = asyncio.Event()
+
 
-async def main():
-    await db.create_metadata()
+async def startup():
     register_handlers(dp)
-    await dp.start_polling(bot)
+    dp.update.outer_middleware(IdentityMiddleware(db))
+    dp.message.middleware(HandlerMetricsMiddleware())
+    dp.callback_query.middleware(HandlerMetricsMiddleware())
+    if profiler is not None:
+        profiler.watch_router(dp)
+        for handler in set(job_handlers.values()):
+            profiler.watch(handler)
+        await profiler.start()
+    await sender.start()
+    await parser_client.start()
+    await job_workers.start()
+    await notifier.start()
+    ready.set()
+
+
+# The schema is applied by migrate.py beforehand, so startup does not touch the
+# database and a failing readiness check only means Postgres is unreachable
+async def is_ready():
+    if not ready.is_set():
+        return False
+    try:
+        await db.ping()
+    except Exception as e:
+        print(e)
+        return False
+    return True
+
+
+async def shutdown():
+    ready.clear()
+    await notifier.stop()
+    await job_workers.stop()
+    await parser_client.close()
+    await sender.stop()
+    if profiler is not None:
+        await profiler.stop()
+
+
+async def main(worker: int = 0):
+    await startup()
+    maintenance_task = asyncio.create_task(run_maintenance())
+    # The GigaChat client is built while the bot already answers
+    warm_up_task = asyncio.create_task(warm_up())
+    runner = None
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook(worker)
+        else:
+            # Polling still serves /metrics and the health checks on the web port
+            runner = await start_server(create_app(is_ready), WEB_HOST, WEB_PORT)
+            await bot.delete_webhook()
+            await dp.start_polling(bot)
+    finally:
+        if runner is not None:
+            await runner.cleanup()
+        maintenance_task.cancel()
+        warm_up_task.cancel()
+        await shutdown()
+
+
+def run_worker(worker: int):
+    asyncio.run(main(worker))
+
+
+# Several webhook workers share the port; FSM state lives in Postgres, so a
+# user's next update can land on any of them
+def run():
+    if BOT_WORKERS == 1:
+        asyncio.run(main())
+        return
+    if BOT_MODE != "webhook":
+        raise RuntimeError("BOT_WORKERS > 1 requires BOT_MODE=webhook")
+
+    metrics.reset_multiprocess_dir()
+    workers = [
+        multiprocessing.Process(target=run_worker, args=(worker,))
+        for worker in range(BOT_WORKERS)
+    ]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
 
 
 if __name__ == "__main__":
-    asyncio.run(main())
+    run()
@@ -0,0 +1,134 @@
+import os
+import time
+
+from aiohttp import web
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+from sqlalchemy import event
+
+# With several bot processes every worker writes its samples to this directory
+# and /metrics aggregates them, whichever worker the scrape lands on
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+LLM_BUCKETS = (0.5, 1, 2.5, 5, 10, 20, 30, 45, 60, 90, 120)
+
+updates = Histogram(
+    "bot_update_seconds",
+    "Time spent in a message or callback handler",
+    ["handler", "plan", "status"],
+)
+db_queries = Histogram(
+    "bot_db_query_seconds",
+    "Time spent executing a database statement",
+    ["operation"],
+)
+parser_requests = Histogram(
+    "bot_parser_request_seconds",
+    "Latency of a single POST to the parser",
+    ["status"],
+)
+parser_outcomes = Counter(
+    "bot_parser_outcomes_total",
+    "Parser calls by outcome, retries included",
+    ["outcome"],
+)
+llm_requests = Histogram(
+    "bot_llm_request_seconds",
+    "GigaChat call latency, including the time the stream was read",
+    ["mode", "status"],
+    buckets=LLM_BUCKETS,
+)
+llm_tokens = Counter(
+    "bot_llm_tokens_total",
+    "Tokens sent to and received from GigaChat",
+    ["mode", "direction"],
+)
+llm_in_flight = Gauge(
+    "bot_llm_in_flight",
+    "GigaChat calls currently holding a pool slot",
+    multiprocess_mode="livesum",
+)
+llm_queue_depth = Gauge(
+    "bot_llm_queue_depth",
+    "Calls waiting for a free GigaChat slot",
+    multiprocess_mode="livesum",
+)
+analyses = Histogram(
+    "bot_analysis_seconds",
+    "Duration of a background analysis job",
+    ["kind", "status"],
+    buckets=LLM_BUCKETS,
+)
+analyses_in_flight = Gauge(
+    "bot_analyses_in_flight",
+    "Background analysis jobs currently running",
+    ["kind"],
+    multiprocess_mode="livesum",
+)
+telegram_requests = Histogram(
+    "bot_telegram_request_seconds",
+    "Latency of Bot API calls",
+    ["method", "status"],
+)
+outbound_messages = Counter(
+    "bot_outbound_messages_total",
+    "Texts queued in the outbound sender by outcome",
+    ["priority", "outcome"],
+)
+outbound_queue_depth = Gauge(
+    "bot_outbound_queue_depth",
+    "Texts waiting in the outbound sender",
+    multiprocess_mode="livesum",
+)
+prescreen_checks = Counter(
+    "bot_prescreen_checks_total",
+    "Profiles checked before the LLM by result; every reason other than "
+    "'analyzed' is a GigaChat call saved",
+    ["reason"],
+)
+compaction_saved_tokens = Histogram(
+    "bot_compaction_saved_tokens",
+    "Estimated prompt tokens removed by the compactor per report",
+    buckets=(0, 100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000),
+)
+compaction_duplicates = Counter(
+    "bot_compaction_duplicates_total",
+    "Near-duplicate posts dropped before prompting",
+)
+
+
+def observe_engine(engine):
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def before_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def after_execute(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["query_started"].pop()
+        operation = statement.lstrip().split(None, 1)[0].upper()
+        db_queries.labels(operation).observe(time.perf_counter() - started)
+
+
+def reset_multiprocess_dir():
+    if not MULTIPROC_DIR:
+        return
+    for name in os.listdir(MULTIPROC_DIR):
+        if name.endswith(".db"):
+            os.remove(os.path.join(MULTIPROC_DIR, name))
+
+
+async def metrics_handler(request: web.Request):
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        body = generate_latest(registry)
+    else:
+        body = generate_latest()
+    return web.Response(body=body, headers={"Content-Type": CONTENT_TYPE_LATEST})
@@ -0,0 +1,65 @@
+"""Applies the SQL migrations in bot/migrations to the bot's database.
+
+    python bot/migrate.py
+
+Run it before starting the bot; docker-compose does so in the migrate service.
+Files are applied in name order, each in its own transaction, and recorded in
+schema_migrations, so another run only applies the new ones. To change the
+schema, add the next numbered file instead of editing an applied one.
+"""
+
+import asyncio
+import os
+from os.path import dirname, join
+
+from database.database import url
+from sqlalchemy.ext.asyncio import create_async_engine
+
+MIGRATIONS_DIR = join(dirname(__file__), "migrations")
+# Held while migrating, so two runs started together apply each file once
+LOCK_ID = 7315
+
+
+def migration_files():
+    return sorted(name for name in os.listdir(MIGRATIONS_DIR) if name.endswith(".sql"))
+
+
+async def apply(connection):
+    await connection.execute("""CREATE TABLE IF NOT EXISTS schema_migrations (
+            version VARCHAR PRIMARY KEY,
+            applied_at TIMESTAMP WITH TIME ZONE DEFAULT now()
+        )""")
+    rows = await connection.fetch("SELECT version FROM schema_migrations")
+    applied = {row["version"] for row in rows}
+    for name in migration_files():
+        version = name.removesuffix(".sql")
+        if version in applied:
+            continue
+        with open(join(MIGRATIONS_DIR, name)) as file:
+            sql = file.read()
+        # Without arguments asyncpg runs the whole file as one script
+        async with connection.transaction():
+            await connection.execute(sql)
+            await connection.execute(
+                "INSERT INTO schema_migrations (version) VALUES ($1)", version
+            )
+        print(f"applied {name}")
+
+
+async def migrate(database_url: str = url):
+    engine = create_async_engine(database_url)
+    try:
+        async with engine.connect() as conn:
+            raw = await conn.get_raw_connection()
+            connection = raw.driver_connection
+            await connection.execute("SELECT pg_advisory_lock($1)", LOCK_ID)
+            try:
+                await apply(connection)
+            finally:
+                await connection.execute("SELECT pg_advisory_unlock($1)", LOCK_ID)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(migrate())
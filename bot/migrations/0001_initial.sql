@@ -0,0 +1,147 @@
+-- Schema as create_all used to leave it. Every statement is conditional, so
+-- this also adopts a database created by earlier versions of the bot.
+
+CREATE TABLE IF NOT EXISTS users (
+    id BIGSERIAL NOT NULL,
+    balance_id INTEGER,
+    username VARCHAR,
+    full_name VARCHAR,
+    plan VARCHAR,
+    PRIMARY KEY (id)
+);
+
+CREATE TABLE IF NOT EXISTS balances (
+    id SERIAL NOT NULL,
+    owner_id BIGINT NOT NULL,
+    amount INTEGER NOT NULL,
+    uniq_code VARCHAR,
+    subscription_end DATE,
+    PRIMARY KEY (id)
+);
+
+-- users and balances reference each other, so the keys are added afterwards
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'users_balance_id_fkey'
+    ) THEN
+        ALTER TABLE users ADD CONSTRAINT users_balance_id_fkey
+            FOREIGN KEY (balance_id) REFERENCES balances (id);
+    END IF;
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint WHERE conname = 'balances_owner_id_fkey'
+    ) THEN
+        ALTER TABLE balances ADD CONSTRAINT balances_owner_id_fkey
+            FOREIGN KEY (owner_id) REFERENCES users (id);
+    END IF;
+END
+$$;
+
+CREATE INDEX IF NOT EXISTS ix_users_balance_id_id ON users (balance_id, id);
+CREATE INDEX IF NOT EXISTS ix_balances_id ON balances (id);
+CREATE INDEX IF NOT EXISTS ix_balances_owner_id ON balances (owner_id);
+CREATE INDEX IF NOT EXISTS ix_balances_subscription_end_id ON balances (subscription_end, id);
+CREATE INDEX IF NOT EXISTS ix_balances_amount_id ON balances (amount, id);
+
+-- Codes shared by several balances (the old 4-digit codes could collide) are
+-- kept by the oldest balance only; the others get a fresh code on the next
+-- /get_code
+UPDATE balances SET uniq_code = NULL
+WHERE id IN (
+    SELECT id FROM (
+        SELECT id, row_number() OVER (PARTITION BY uniq_code ORDER BY id) AS rank
+        FROM balances
+        WHERE uniq_code IS NOT NULL
+    ) AS ranked
+    WHERE rank > 1
+);
+CREATE UNIQUE INDEX IF NOT EXISTS ix_balances_uniq_code ON balances (uniq_code);
+
+CREATE TABLE IF NOT EXISTS analysis_jobs (
+    id SERIAL NOT NULL,
+    kind VARCHAR NOT NULL,
+    user_id BIGINT NOT NULL,
+    chat_id BIGINT NOT NULL,
+    payload JSON NOT NULL,
+    status VARCHAR NOT NULL,
+    attempts INTEGER NOT NULL,
+    error VARCHAR,
+    locked_until TIMESTAMP WITH TIME ZONE,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    PRIMARY KEY (id),
+    FOREIGN KEY (user_id) REFERENCES users (id)
+);
+CREATE INDEX IF NOT EXISTS ix_analysis_jobs_status_id ON analysis_jobs (status, id);
+
+CREATE TABLE IF NOT EXISTS analysis_cache (
+    vk_id BIGINT NOT NULL,
+    posts_digest VARCHAR(64) NOT NULL,
+    report TEXT NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    last_used_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    PRIMARY KEY (vk_id, posts_digest)
+);
+CREATE INDEX IF NOT EXISTS ix_analysis_cache_last_used_at ON analysis_cache (last_used_at);
+
+CREATE TABLE IF NOT EXISTS analysis_snapshots (
+    vk_id BIGSERIAL NOT NULL,
+    report TEXT NOT NULL,
+    last_post_date BIGINT NOT NULL,
+    updated_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    PRIMARY KEY (vk_id)
+);
+CREATE INDEX IF NOT EXISTS ix_analysis_snapshots_updated_at ON analysis_snapshots (updated_at);
+
+CREATE TABLE IF NOT EXISTS credit_reservations (
+    id SERIAL NOT NULL,
+    balance_id INTEGER NOT NULL,
+    user_id BIGINT NOT NULL,
+    amount INTEGER NOT NULL,
+    status VARCHAR NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    settled_at TIMESTAMP WITH TIME ZONE,
+    PRIMARY KEY (id),
+    FOREIGN KEY (balance_id) REFERENCES balances (id),
+    FOREIGN KEY (user_id) REFERENCES users (id)
+);
+CREATE INDEX IF NOT EXISTS ix_credit_reservations_status_created_at ON credit_reservations (status, created_at);
+CREATE INDEX IF NOT EXISTS ix_credit_reservations_balance_id_id ON credit_reservations (balance_id, id);
+
+CREATE TABLE IF NOT EXISTS reports (
+    id SERIAL NOT NULL,
+    vk_id BIGINT,
+    link VARCHAR NOT NULL,
+    kind VARCHAR NOT NULL,
+    requester_id BIGINT NOT NULL,
+    balance_id INTEGER NOT NULL,
+    reservation_id INTEGER,
+    report TEXT NOT NULL,
+    search TSVECTOR GENERATED ALWAYS AS (to_tsvector('russian', report)) STORED,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    PRIMARY KEY (id),
+    FOREIGN KEY (requester_id) REFERENCES users (id),
+    FOREIGN KEY (balance_id) REFERENCES balances (id),
+    FOREIGN KEY (reservation_id) REFERENCES credit_reservations (id)
+);
+CREATE INDEX IF NOT EXISTS ix_reports_balance_id_id ON reports (balance_id, id);
+CREATE INDEX IF NOT EXISTS ix_reports_reservation_id ON reports (reservation_id);
+CREATE INDEX IF NOT EXISTS ix_reports_search ON reports USING gin (search);
+
+CREATE TABLE IF NOT EXISTS notifications (
+    balance_id INTEGER NOT NULL,
+    kind VARCHAR NOT NULL,
+    key VARCHAR NOT NULL,
+    sent_at TIMESTAMP WITH TIME ZONE DEFAULT now(),
+    PRIMARY KEY (balance_id, kind, key),
+    FOREIGN KEY (balance_id) REFERENCES balances (id)
+);
+
+CREATE TABLE IF NOT EXISTS fsm_states (
+    key VARCHAR NOT NULL,
+    state VARCHAR,
+    data JSONB NOT NULL,
+    expires_at TIMESTAMP WITH TIME ZONE NOT NULL,
+    PRIMARY KEY (key)
+);
+CREATE INDEX IF NOT EXISTS ix_fsm_states_expires_at ON fsm_states (expires_at);
@@ -0,0 +1,13 @@
+-- The low balance warning moves from the notifications table to a flag on the
+-- balance, cleared on top-up, so the scan only reads balances not yet warned.
+
+ALTER TABLE balances
+    ADD COLUMN IF NOT EXISTS low_balance_notified BOOLEAN DEFAULT false NOT NULL;
+
+UPDATE balances SET low_balance_notified = true
+WHERE id IN (SELECT balance_id FROM notifications WHERE kind = 'low_balance');
+DELETE FROM notifications WHERE kind = 'low_balance';
+
+DROP INDEX IF EXISTS ix_balances_amount_id;
+CREATE INDEX IF NOT EXISTS ix_balances_low_balance_pending ON balances (amount, id)
+    WHERE NOT low_balance_notified;
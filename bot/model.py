@@ -1,41 +1,280 @@
+import asyncio
 import os
-from os.path import dirname, join
+import threading
+import time
 
-from dotenv import load_dotenv
-from langchain_core.messages import SystemMessage
-from langchain_gigachat.chat_models import GigaChat
-
-dotevn_path = join(dirname(__file__), ".env")
-load_dotenv(dotevn_path)
+import config
+import metrics
 
 sber = os.getenv("SBER_TOKEN")
+LLM_MAX_IN_FLIGHT = int(os.getenv("LLM_MAX_IN_FLIGHT", "4"))
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_CHARS_PER_TOKEN = float(os.getenv("PROMPT_CHARS_PER_TOKEN", "3"))
 
-model = GigaChat(
-    credentials=sber,
-    verify_ssl_certs=False,
-    scope="GIGACHAT_API_PERS",
-)
+model = None
+model_lock = threading.Lock()
 
 
-async def analyze_profile(data):
-    result = model.invoke(
-        [
-            SystemMessage(
-                content=f"""На основании переданных данных сделай вывод о личности пользователя.
-Тебе будет предоставлен JSON-объект с полями posts, в котором перечислено содержание последних постов пользователя и даты этих постов,
-Если для анализа недостаточно данных или информации о человеке слишком мало, выведи сообщение 'Недостаточно данных о пользователе.' и завершай.
-Формат вывода должен быть следующим:
-```
+# langchain_gigachat takes about a second to import, so the client is built on
+# first use or by warm_up in the background, not when the bot starts.
+# GIGACHAT_BASE_URL and GIGACHAT_ACCESS_TOKEN point the bot at another
+# endpoint, e.g. the fake GigaChat of the benchmarks
+def get_model():
+    global model
+    with model_lock:
+        if model is None:
+            from langchain_gigachat.chat_models import GigaChat
+
+            model = GigaChat(
+                credentials=sber,
+                verify_ssl_certs=False,
+                scope="GIGACHAT_API_PERS",
+                timeout=LLM_TIMEOUT,
+                base_url=os.getenv("GIGACHAT_BASE_URL") or None,
+                access_token=os.getenv("GIGACHAT_ACCESS_TOKEN") or None,
+            )
+    return model
+
+
+async def warm_up():
+    try:
+        await asyncio.to_thread(get_model)
+    except Exception as e:
+        print(e)
+
+
+class LLMPool:
+    def __init__(self, max_in_flight: int, timeout: float):
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+
+    async def _acquire(self):
+        metrics.llm_queue_depth.inc()
+        try:
+            await self._semaphore.acquire()
+        finally:
+            metrics.llm_queue_depth.dec()
+        metrics.llm_in_flight.inc()
+
+    def _release(self):
+        metrics.llm_in_flight.dec()
+        self._semaphore.release()
+
+    # Off the event loop, so an update that arrives before warm_up is done
+    # does not stall the others
+    async def _model(self):
+        return model or await asyncio.to_thread(get_model)
+
+    async def invoke(self, messages):
+        client = await self._model()
+        await self._acquire()
+        started = time.monotonic()
+        status = "error"
+        try:
+            result = await asyncio.wait_for(client.ainvoke(messages), self.timeout)
+            status = "ok"
+        finally:
+            metrics.llm_requests.labels("invoke", status).observe(
+                time.monotonic() - started
+            )
+            self._release()
+
+        usage = result.response_metadata.get("token_usage")
+        if usage is not None:
+            metrics.llm_tokens.labels("invoke", "prompt").inc(usage.prompt_tokens)
+            metrics.llm_tokens.labels("invoke", "completion").inc(
+                usage.completion_tokens
+            )
+        return result
+
+    # The slot is held until the whole stream is read. The timeout is a
+    # deadline for the whole stream, but it only ever wraps the wait for the
+    # next chunk: a timeout scope open across the yield would cancel the
+    # consumer while it is busy, e.g. editing the Telegram message.
+    # GigaChat does not report usage for streams, so tokens are estimated.
+    async def stream(self, messages):
+        client = await self._model()
+        await self._acquire()
+        started = time.monotonic()
+        deadline = started + self.timeout
+        status = "error"
+        completion = 0
+        chunks = client.astream(messages)
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("GigaChat stream timed out")
+                try:
+                    chunk = await asyncio.wait_for(anext(chunks), remaining)
+                except StopAsyncIteration:
+                    break
+                completion += len(chunk.content)
+                yield chunk
+            status = "ok"
+        finally:
+            metrics.llm_requests.labels("stream", status).observe(
+                time.monotonic() - started
+            )
+            self._release()
+            prompt = sum(len(content) for _, content in messages)
+            metrics.llm_tokens.labels("stream", "prompt").inc(
+                prompt / LLM_CHARS_PER_TOKEN
+            )
+            metrics.llm_tokens.labels("stream", "completion").inc(
+                completion / LLM_CHARS_PER_TOKEN
+            )
+            await chunks.aclose()
+
+
+llm_pool = LLMPool(LLM_MAX_IN_FLIGHT, LLM_TIMEOUT)
+
+INSUFFICIENT_DATA = "Недостаточно данных о пользователе."
+
+
+def is_insufficient(text: str):
+    return text.strip() == INSUFFICIENT_DATA
+
+
+# True while a partial stream could still turn out to be INSUFFICIENT_DATA
+def may_be_insufficient(text: str):
+    return INSUFFICIENT_DATA.startswith(text.strip())
+
+
+REPORT_FORMAT = """```
 Личные качества: [укажи личные качества человека, исходя из его профиля (soft skills)]. 
 Интересы: [перечисление интересов пользователя, основанных на его постах и группах].]
 Обратить внимание: [указание на потенциальные риски для репутации компании, такие как неподобающие высказывания, агрессивное поведение или аморальный контент.Если ничего не найдено, напиши 'не обнаружено'].
-```
+```"""
+NO_FINDINGS = "Нет наблюдений."
+
+
+# Prompts are (role, content) pairs, which GigaChat accepts as messages, so
+# building one does not need langchain loaded
+def build_messages(data):
+    return [
+        (
+            "system",
+            f"""На основании переданных данных сделай вывод о личности пользователя.
+Тебе будет предоставлен список последних постов пользователя, по одному на строку в формате 'ГГГГ-ММ-ДД: текст'.
+Если для анализа недостаточно данных или информации о человеке слишком мало, выведи сообщение 'Недостаточно данных о пользователе.' и завершай.
+Формат вывода должен быть следующим:
+{REPORT_FORMAT}
 Данные для анализа: 
-```json
+```
 {data}
-```"""
+```""",
+        ),
+    ]
+
+
+# Delta prompt: only the posts published since the previous report are sent
+def build_update_messages(report: str, data):
+    return [
+        (
+            "system",
+            f"""Тебе будет предоставлен предыдущий отчёт о личности пользователя и посты, опубликованные им после составления этого отчёта, по одному на строку в формате 'ГГГГ-ММ-ДД: текст'.
+Обнови отчёт с учётом новых постов: дополни или исправь пункты, которые они затрагивают, остальное оставь без изменений. Если новые посты ничего не меняют, выведи предыдущий отчёт без изменений.
+Формат вывода должен быть следующим:
+{REPORT_FORMAT}
+Предыдущий отчёт: 
+```
+{report}
+```
+Новые посты: 
+```
+{data}
+```""",
+        ),
+    ]
+
+
+async def analyze_profile(data):
+    return await invoke_report(build_messages(data))
+
+
+async def update_profile(report: str, data):
+    return await invoke_report(build_update_messages(report, data))
+
+
+async def invoke_report(messages):
+    result = await llm_pool.invoke(messages)
+    return result.content
+
+
+# Yields the report generated so far after every streamed chunk
+async def analyze_profile_stream(data):
+    async for text in stream_report(build_messages(data)):
+        yield text
+
+
+async def update_profile_stream(report: str, data):
+    async for text in stream_report(build_update_messages(report, data)):
+        yield text
+
+
+async def stream_report(messages):
+    text = ""
+    async for chunk in llm_pool.stream(messages):
+        text += chunk.content
+        yield text
+
+
+# Map step of the deep analysis: notes on one chunk of a long post history
+async def summarize_chunk(data):
+    result = await llm_pool.invoke(
+        [
+            (
+                "system",
+                f"""Тебе будет предоставлен фрагмент истории постов пользователя, по одному посту на строку в формате 'ГГГГ-ММ-ДД: текст'.
+Кратко, не более чем в 10 пунктах, выпиши наблюдения о личных качествах пользователя, его интересах и о потенциальных рисках для репутации компании, таких как неподобающие высказывания, агрессивное поведение или аморальный контент.
+Опирайся только на эти посты. Если наблюдений нет, выведи сообщение '{NO_FINDINGS}' и завершай.
+Посты: 
+```
+{data}
+```""",
+            ),
+        ]
+    )
+    return result.content
+
+
+# Intermediate reduce step: folds several notes into one without losing risks
+async def merge_summaries(summaries: list):
+    notes = "\n\n".join(summaries)
+    result = await llm_pool.invoke(
+        [
+            (
+                "system",
+                f"""Тебе будут предоставлены заметки о пользователе, составленные по разным частям истории его постов.
+Объедини их в одну краткую заметку, не более чем в 15 пунктах: убери повторы, но сохрани все упоминания потенциальных рисков для репутации компании.
+Заметки: 
+```
+{notes}
+```""",
+            ),
+        ]
+    )
+    return result.content
+
+
+# Final reduce step: turns the notes into the standard report
+async def reduce_summaries(summaries: list):
+    notes = "\n\n".join(summaries)
+    result = await llm_pool.invoke(
+        [
+            (
+                "system",
+                f"""На основании заметок, составленных по истории постов пользователя, сделай вывод о его личности.
+Если для анализа недостаточно данных или информации о человеке слишком мало, выведи сообщение '{INSUFFICIENT_DATA}' и завершай.
+Формат вывода должен быть следующим:
+{REPORT_FORMAT}
+Заметки: 
+```
+{notes}
+```""",
             ),
         ]
     )
-    print(result.content)
     return result.content
@@ -0,0 +1,100 @@
+import asyncio
+from datetime import date, timedelta
+
+from utils.sender import BULK
+from utils.utils import translate_month_in_str
+
+
+def expiry_text(row, owner: bool):
+    date_formatted = translate_month_in_str(row.value)
+    if owner:
+        return f"Ваша подписка закончится {date_formatted}. Продлить её можно командой /sub. 🔔"
+    return f"Подписка вашей компании закончится {date_formatted}. Продлить её может владелец аккаунта. 🔔"
+
+
+def low_balance_text(row, owner: bool):
+    return f"На вашем балансе осталось токенов: {row.value}. Пополнить его можно командой /tokens. 🔔"
+
+
+# Periodically reminds the owner and linked users of a balance whose
+# subscription is about to end or whose tokens are running out. Each scan walks
+# the matching balances in keyset batches of batch_size, so one query never
+# grows with the number of users, and waits for a batch's messages to leave
+# the sender before reading the next. Claiming a batch before sending makes
+# each reminder go out once, even with several bot processes scanning.
+class NotificationScheduler:
+    def __init__(
+        self,
+        db,
+        sender,
+        interval: float,
+        batch_size: int,
+        expiry_days: int,
+        low_balance: int,
+    ):
+        self.db = db
+        self.sender = sender
+        self.interval = interval
+        self.batch_size = batch_size
+        self.expiry_days = expiry_days
+        self.low_balance = low_balance
+        self._task = None
+
+    async def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+    async def _run(self):
+        while True:
+            try:
+                await self.run_once()
+            except Exception as e:
+                print(e)
+            await asyncio.sleep(self.interval)
+
+    async def run_once(self):
+        until = date.today() + timedelta(days=self.expiry_days)
+        expiring = await self._scan(
+            lambda after: self.db.get_expiring_balances(until, after, self.batch_size),
+            lambda rows: self.db.claim_notifications(
+                "expiry", {row.id: row.value.isoformat() for row in rows}
+            ),
+            expiry_text,
+        )
+        running_low = await self._scan(
+            lambda after: self.db.get_low_balances(
+                self.low_balance, after, self.batch_size
+            ),
+            lambda rows: self.db.claim_low_balances([row.id for row in rows]),
+            low_balance_text,
+        )
+        return expiring, running_low
+
+    async def _scan(self, fetch, claim, text):
+        after, sent = None, 0
+        while True:
+            rows = await fetch(after)
+            if not rows:
+                return sent
+            after = (rows[-1].value, rows[-1].id)
+
+            claimed = await claim(rows)
+            members = await self.db.get_balance_members(claimed)
+            deliveries = []
+            for row in rows:
+                if row.id not in claimed:
+                    continue
+                for user_id in {row.owner_id, *members.get(row.id, ())}:
+                    deliveries.append(
+                        self.sender.post(
+                            user_id, text(row, user_id == row.owner_id), BULK
+                        )
+                    )
+            await asyncio.gather(*deliveries, return_exceptions=True)
+            sent += len(deliveries)
+
+            if len(rows) < self.batch_size:
+                return sent
@@ -0,0 +1,130 @@
+import asyncio
+import random
+import time
+
+import aiohttp
+import metrics
+
+
+class CircuitOpenError(Exception):
+    pass
+
+
+class ParserClient:
+    def __init__(
+        self,
+        url: str,
+        pool_size: int,
+        connect_timeout: float,
+        read_timeout: float,
+        retries: int,
+        backoff: float,
+        breaker_threshold: int,
+        breaker_reset: float,
+    ):
+        self.url = url
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+
+        self._session = None
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    async def start(self):
+        connector = aiohttp.TCPConnector(
+            limit=self.pool_size,
+            ttl_dns_cache=300,
+            keepalive_timeout=60,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=None,
+            connect=self.connect_timeout,
+            sock_read=self.read_timeout,
+        )
+        self._session = aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    @property
+    def circuit_open(self):
+        return self._opened_at is not None
+
+    # Returns True when this request is the half-open probe
+    def _check_circuit(self):
+        if self._opened_at is None:
+            return False
+        if self._probing or time.monotonic() - self._opened_at < self.breaker_reset:
+            metrics.parser_outcomes.labels("rejected").inc()
+            raise CircuitOpenError("parser circuit is open")
+        # Half-open: this request alone probes the parser while the circuit
+        # stays open for the others; one failure reopens it
+        self._probing = True
+        return True
+
+    def _record_failure(self):
+        self._failures += 1
+        if self._probing or self._failures >= self.breaker_threshold:
+            self._opened_at = time.monotonic()
+            self._probing = False
+
+    def _record_success(self):
+        self._failures = 0
+        self._opened_at = None
+        self._probing = False
+
+    async def _post(self, payload: dict):
+        started = time.monotonic()
+        status = "error"
+        try:
+            async with self._session.post(self.url, json=payload) as response:
+                status = str(response.status)
+                response.raise_for_status()
+                return await response.json()
+        finally:
+            metrics.parser_requests.labels(status).observe(time.monotonic() - started)
+
+    async def parse(self, link: str, count: int = None, offset: int = 0):
+        payload = {"link": link}
+        if count is not None:
+            payload.update(count=count, offset=offset)
+
+        probe = self._check_circuit()
+        try:
+            attempt = 0
+            while True:
+                try:
+                    json = await self._post(payload)
+                except aiohttp.ClientResponseError as e:
+                    if e.status < 500:
+                        metrics.parser_outcomes.labels("error").inc()
+                        raise
+                    error = e
+                except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                    error = e
+                else:
+                    self._record_success()
+                    metrics.parser_outcomes.labels("ok").inc()
+                    return json["result"]
+
+                self._record_failure()
+                if attempt >= self.retries or self.circuit_open:
+                    metrics.parser_outcomes.labels("error").inc()
+                    raise error
+                attempt += 1
+                metrics.parser_outcomes.labels("retried").inc()
+                # Full jitter keeps retries from a burst of jobs from lining up
+                await asyncio.sleep(random.uniform(0, self.backoff * 2**attempt))
+        finally:
+            # A probe that ended without a verdict (a 4xx, cancellation) lets
+            # the next request probe instead
+            if probe and self._probing:
+                self._probing = False
@@ -0,0 +1,160 @@
+import asyncio
+import collections
+import json
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+
+
+def frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})"
+
+
+# Statistical profiler for the event loop thread. A background thread samples
+# the loop's stack every interval seconds and charges the sample to the watched
+# handler whose coroutine is on the stack (or to "other"), so nothing runs per
+# update. The same thread watches a heartbeat task to catch callbacks that
+# block the loop, and writes folded stacks (flamegraph.pl / speedscope input)
+# and stall reports to directory every dump_interval seconds.
+class SamplingProfiler:
+    def __init__(
+        self,
+        directory: str,
+        interval: float,
+        dump_interval: float,
+        lag_threshold: float,
+    ):
+        self.directory = directory
+        self.interval = interval
+        self.dump_interval = dump_interval
+        self.lag_threshold = lag_threshold
+        self.beat_interval = lag_threshold / 4
+        self.handlers = {}
+        self.samples = collections.defaultdict(collections.Counter)
+        self.stalls = []
+        self.heartbeat = time.monotonic()
+
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._heartbeat_task = None
+        self._loop_thread_id = None
+        self._window_started = time.time()
+
+    def watch(self, func, name: str = None):
+        self.handlers[func.__code__] = name or func.__name__
+
+    # Every handler registered on the router and its sub-routers. Time in the
+    # dispatcher that is not inside a handler (outer middlewares, routing,
+    # filters) is charged to "dispatch".
+    def watch_router(self, router):
+        if hasattr(router, "feed_update"):
+            self.watch(type(router).feed_update, "dispatch")
+        for event, observer in router.observers.items():
+            for handler in observer.handlers:
+                self.watch(handler.callback, "dispatch" if event == "update" else None)
+        for sub_router in router.sub_routers:
+            self.watch_router(sub_router)
+
+    async def start(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat_task = asyncio.create_task(self._beat())
+        self._thread = threading.Thread(
+            target=self._run, name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    async def stop(self):
+        self._heartbeat_task.cancel()
+        self._stop.set()
+        await asyncio.to_thread(self._thread.join)
+        self.dump()
+
+    async def _beat(self):
+        while True:
+            self.heartbeat = time.monotonic()
+            await asyncio.sleep(self.beat_interval)
+
+    def _run(self):
+        next_dump = time.monotonic() + self.dump_interval
+        stall_beat, stall = None, None
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is not None:
+                self._sample(frame)
+
+            # The heartbeat has not moved: a callback is holding the loop
+            lag = time.monotonic() - self.heartbeat - self.beat_interval
+            if lag > self.lag_threshold and frame is not None:
+                if stall_beat != self.heartbeat:
+                    stall_beat = self.heartbeat
+                    stall = {
+                        "at": datetime.now(timezone.utc).isoformat(),
+                        "stack": [frame_label(f) for f in self._stack(frame)],
+                    }
+                    with self._lock:
+                        self.stalls.append(stall)
+                stall["lag_ms"] = round(lag * 1000, 1)
+
+            if time.monotonic() >= next_dump:
+                self.dump()
+                next_dump = time.monotonic() + self.dump_interval
+
+    def _stack(self, frame):
+        stack = []
+        while frame is not None:
+            stack.append(frame)
+            frame = frame.f_back
+        stack.reverse()
+        return stack
+
+    def _sample(self, frame):
+        # Waiting in the selector is idle time, not work
+        if frame.f_code.co_filename.endswith("selectors.py"):
+            return
+        stack = self._stack(frame)
+        # The innermost watched frame owns the sample
+        owner, start = "other", 0
+        for index, f in enumerate(stack):
+            name = self.handlers.get(f.f_code)
+            if name is not None:
+                owner, start = name, index
+            elif owner == "other" and f.f_code.co_name == "_run":
+                if f.f_code.co_filename.endswith("events.py"):
+                    start = index + 1
+        folded = ";".join(frame_label(f) for f in stack[start:])
+        with self._lock:
+            self.samples[owner][folded] += 1
+
+    def dump(self):
+        with self._lock:
+            samples, self.samples = self.samples, collections.defaultdict(
+                collections.Counter
+            )
+            stalls, self.stalls = self.stalls, []
+        started, self._window_started = self._window_started, time.time()
+        if not samples and not stalls:
+            return
+
+        prefix = os.path.join(
+            self.directory,
+            f"{datetime.now(timezone.utc):%Y%m%dT%H%M%S}-{os.getpid()}",
+        )
+        for owner, stacks in samples.items():
+            with open(f"{prefix}-{owner}.folded", "w") as file:
+                for stack, count in stacks.most_common():
+                    file.write(f"{stack} {count}\n")
+        summary = {
+            "window_seconds": round(time.time() - started, 1),
+            "sample_interval_ms": self.interval * 1000,
+            "samples": {
+                owner: sum(stacks.values()) for owner, stacks in samples.items()
+            },
+            "stalls": stalls,
+        }
+        with open(f"{prefix}-summary.json", "w") as file:
+            json.dump(summary, file, ensure_ascii=False, indent=2)
@@ -0,0 +1,45 @@
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+from metrics import metrics_handler
+
+
+async def live_handler(request: web.Request):
+    return web.Response(text="ok")
+
+
+# /live answers as long as the process serves HTTP; /ready only once ready()
+# confirms the bot can handle updates, so compose and load balancers hold
+# traffic until then
+def create_app(ready=None):
+    async def ready_handler(request: web.Request):
+        if ready is not None and not await ready():
+            return web.Response(status=503, text="not ready")
+        return web.Response(text="ok")
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    app.router.add_get("/live", live_handler)
+    app.router.add_get("/ready", ready_handler)
+    return app
+
+
+# Telegram gets its 200 as soon as the secret is verified; the update is then
+# processed by the dispatcher in a background task
+def setup_webhook(app: web.Application, dp, bot, path: str, secret: str):
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        secret_token=secret,
+        handle_in_background=True,
+    ).register(app, path=path)
+    setup_application(app, dp, bot=bot)
+
+
+# reuse_port lets several bot processes accept on the same port
+async def start_server(
+    app: web.Application, host: str, port: int, reuse_port: bool = False
+):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port, reuse_port=reuse_port).start()
+    return runner
@@ -0,0 +1,146 @@
+"""Local stand-ins for Telegram when running the bot in webhook mode.
+
+    python tools/fake_telegram.py api --port 8081
+        Fake Bot API. Point the bot at it with TELEGRAM_API_URL=http://localhost:8081
+        and every sendMessage/editMessageText/... call is logged and acknowledged.
+
+    python tools/fake_telegram.py send --url http://localhost:8001/webhook \
+            --secret <WEBHOOK_SECRET> --text /balance --count 100 --concurrency 10
+        Posts synthetic message updates to the webhook like Telegram does and
+        reports the webhook response latency.
+"""
+
+import argparse
+import asyncio
+import itertools
+import json
+import time
+
+from aiohttp import ClientSession, web
+
+message_ids = itertools.count(1)
+
+
+def fake_user(user_id: int):
+    return {"id": user_id, "is_bot": False, "first_name": f"user{user_id}"}
+
+
+def fake_message(chat_id: int, text: str = None, from_user: dict = None):
+    message = {
+        "message_id": next(message_ids),
+        "date": int(time.time()),
+        "chat": {"id": chat_id, "type": "private"},
+    }
+    if text is not None:
+        message["text"] = text
+    if from_user is not None:
+        message["from"] = from_user
+    return message
+
+
+def fake_update(update_id: int, user_id: int, text: str):
+    return {
+        "update_id": update_id,
+        "message": fake_message(user_id, text, fake_user(user_id)),
+    }
+
+
+async def api_handler(request: web.Request):
+    method = request.match_info["method"]
+    params = dict(await request.post())
+    if request.app["verbose"]:
+        # Uploaded files (sendDocument and friends) are logged by name
+        print(
+            method,
+            json.dumps(
+                params,
+                ensure_ascii=False,
+                default=lambda field: getattr(field, "filename", str(field)),
+            ),
+        )
+
+    if request.app["on_request"] is not None:
+        request.app["on_request"](method, params)
+
+    if method == "getMe":
+        result = {**fake_user(1), "is_bot": True, "username": "fake_bot"}
+    elif method.startswith(("send", "edit")) and method != "sendChatAction":
+        chat_id = int(params.get("chat_id", 0))
+        result = fake_message(chat_id, params.get("text"))
+    else:
+        result = True
+    return web.json_response({"ok": True, "result": result})
+
+
+# on_request(method, params) is called for every Bot API call, e.g. by the
+# benchmarks to see when a report was delivered
+def create_api_app(verbose: bool = True, on_request=None):
+    app = web.Application()
+    app["verbose"] = verbose
+    app["on_request"] = on_request
+    app.router.add_post("/bot{token}/{method}", api_handler)
+    return app
+
+
+async def send_updates(url, secret, text, user_id, count, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    headers = {"X-Telegram-Bot-Api-Secret-Token": secret}
+
+    async with ClientSession() as session:
+
+        async def send(update_id):
+            async with semaphore:
+                started = time.monotonic()
+                async with session.post(
+                    url, json=fake_update(update_id, user_id, text), headers=headers
+                ) as response:
+                    await response.read()
+                    latencies.append(time.monotonic() - started)
+                    return response.status
+
+        statuses = await asyncio.gather(*(send(i) for i in range(1, count + 1)))
+
+    latencies.sort()
+    print(f"statuses: { {s: statuses.count(s) for s in set(statuses)} }")
+    print(
+        f"webhook latency ms: p50={latencies[len(latencies) // 2] * 1000:.1f} "
+        f"max={latencies[-1] * 1000:.1f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    api = commands.add_parser("api")
+    api.add_argument("--host", default="127.0.0.1")
+    api.add_argument("--port", type=int, default=8081)
+    api.add_argument("--quiet", action="store_true")
+
+    send = commands.add_parser("send")
+    send.add_argument("--url", default="http://localhost:8001/webhook")
+    send.add_argument("--secret", default="")
+    send.add_argument("--text", default="/help")
+    send.add_argument("--user-id", type=int, default=1)
+    send.add_argument("--count", type=int, default=1)
+    send.add_argument("--concurrency", type=int, default=1)
+
+    args = parser.parse_args()
+    if args.command == "api":
+        web.run_app(create_api_app(not args.quiet), host=args.host, port=args.port)
+    else:
+        asyncio.run(
+            send_updates(
+                args.url,
+                args.secret,
+                args.text,
+                args.user_id,
+                args.count,
+                args.concurrency,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,26 @@
+import io
+import re
+
+from utils.export import CSV_ENCODING, CsvWriter
+from utils.singleflight import normalize_link
+
+# A screen name may contain dots but never ends with one, so a link at the
+# end of a sentence keeps its full stop out
+LINK_PATTERN = re.compile(r"https://(?:www\.|m\.)?vk\.com/[A-Za-z0-9_.]*[A-Za-z0-9_]")
+
+
+# Links in the order they were given, without repeats of the same profile
+def extract_links(text: str):
+    links = {}
+    for link in LINK_PATTERN.findall(text):
+        links.setdefault(normalize_link(link), link)
+    return list(links.values())
+
+
+# rows are (link, status, report)
+def results_csv(rows: list):
+    buffer = io.StringIO()
+    writer = CsvWriter(buffer, ["Ссылка", "Статус", "Отчёт"])
+    for row in rows:
+        writer.writerow(row)
+    return buffer.getvalue().encode(CSV_ENCODING)
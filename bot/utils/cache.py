@@ -0,0 +1,41 @@
+import time
+from collections import OrderedDict
+
+
+# Bounded LRU cache whose entries also expire after ttl seconds
+class TTLCache:
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._data = OrderedDict()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def get(self, key):
+        item = self._data.get(key)
+        if item is not None and item[1] < time.monotonic():
+            del self._data[key]
+            item = None
+
+        if item is None:
+            return None
+
+        self._data.move_to_end(key)
+        return item[0]
+
+    def set(self, key, value):
+        self._data[key] = (value, time.monotonic() + self.ttl)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key):
+        item = self._data.pop(key, None)
+        return item[0] if item else None
+
+    def clear(self):
+        self._data.clear()
@@ -0,0 +1,59 @@
+import csv
+import gzip
+
+# The BOM lets Excel detect UTF-8
+CSV_ENCODING = "utf-8-sig"
+# Excel runs a cell starting with one of these as a formula
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+USAGE_HEADER = [
+    "Дата (UTC)",
+    "ID пользователя",
+    "Имя",
+    "Username",
+    "Списано токенов",
+    "По подписке",
+    "Профили",
+]
+
+
+# Text cells come from users and the model, so the ones Excel would run are
+# quoted with a leading apostrophe
+def safe_cell(value):
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        return "'" + value
+    return value
+
+
+# csv.writer for files opened with CSV_ENCODING that writes header first and
+# passes every cell through safe_cell
+class CsvWriter:
+    def __init__(self, file, header: list):
+        self.writer = csv.writer(file)
+        self.writer.writerow(header)
+
+    def writerow(self, row):
+        self.writer.writerow([safe_cell(value) for value in row])
+
+
+# Writes rows from Database.stream_usage to path as they arrive, gzipped if
+# compress. Returns the number of rows.
+async def write_usage_csv(rows, path: str, compress: bool):
+    opener = gzip.open if compress else open
+    count = 0
+    with opener(path, "wt", encoding=CSV_ENCODING, newline="") as file:
+        writer = CsvWriter(file, USAGE_HEADER)
+        async for row in rows:
+            writer.writerow(
+                [
+                    row.created_at.strftime("%Y-%m-%d %H:%M"),
+                    row.user_id,
+                    row.full_name or "",
+                    row.username or "",
+                    row.amount,
+                    "да" if row.amount == 0 else "",
+                    row.links or "",
+                ]
+            )
+            count += 1
+    return count
@@ -27,6 +27,7 @@ corporation = ReplyKeyboardMarkup(
     keyboard=[
         [
             KeyboardButton(text="Анализ 🔎"),
+            KeyboardButton(text="Глубокий анализ 🔬"),
         ],
         [
             KeyboardButton(text="Оформить подписку ✅"),
@@ -38,6 +39,7 @@ corporation = ReplyKeyboardMarkup(
         ],
         [
             KeyboardButton(text="Привязанные пользователи 👤"),
+            KeyboardButton(text="Поиск по отчётам 🗂"),
         ],
     ],
     resize_keyboard=True,
@@ -66,15 +68,79 @@ subs = InlineKeyboardMarkup(
 )
 
 
-async def users(users):
-    return InlineKeyboardMarkup(
-        inline_keyboard=[
+SELECTED = "✅"
+UNSELECTED = "▫️"
+
+
+# One page of linked users. Which users are ticked lives in the buttons
+# themselves, so toggling and unlinking need no stored state.
+def users_page(users, has_prev: bool, has_next: bool, selected=()):
+    rows = [
+        [
+            InlineKeyboardButton(
+                text=f"{SELECTED if user.id in selected else UNSELECTED} "
+                f"{user.full_name or user.username or user.id} ({user.id})",
+                callback_data=f"users:toggle:{user.id}",
+            )
+        ]
+        for user in users
+    ]
+    navigation = []
+    if has_prev:
+        navigation.append(
+            InlineKeyboardButton(text="◀️", callback_data=f"users:prev:{users[0].id}")
+        )
+    if has_next:
+        navigation.append(
+            InlineKeyboardButton(text="▶️", callback_data=f"users:next:{users[-1].id}")
+        )
+    if navigation:
+        rows.append(navigation)
+    rows.append(
+        [InlineKeyboardButton(text="Отвязать выбранных", callback_data="users:unlink")]
+    )
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def selected_users(markup: InlineKeyboardMarkup):
+    return [
+        int(button.callback_data.rsplit(":", 1)[1])
+        for row in markup.inline_keyboard
+        for button in row
+        if button.callback_data.startswith("users:toggle:")
+        and button.text.startswith(SELECTED)
+    ]
+
+
+def toggle_user(markup: InlineKeyboardMarkup, user_id: int):
+    rows = []
+    for row in markup.inline_keyboard:
+        buttons = []
+        for button in row:
+            if button.callback_data == f"users:toggle:{user_id}":
+                mark, text = button.text.split(" ", 1)
+                mark = UNSELECTED if mark == SELECTED else SELECTED
+                button = button.model_copy(update={"text": f"{mark} {text}"})
+            buttons.append(button)
+        rows.append(buttons)
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
+
+def search_results(reports, has_next: bool):
+    rows = [
+        [
+            InlineKeyboardButton(
+                text=f"📄 #{report.id}", callback_data=f"search:open:{report.id}"
+            )
+            for report in reports
+        ]
+    ]
+    if has_next:
+        rows.append(
             [
                 InlineKeyboardButton(
-                    text=f"{user.id}",
-                    callback_data=f"delete_{user.id}",
+                    text="Дальше ▶️", callback_data=f"search:next:{reports[-1].id}"
                 )
             ]
-            for user in users
-        ]
-    )
+        )
+    return InlineKeyboardMarkup(inline_keyboard=rows)
@@ -0,0 +1,55 @@
+import time
+
+import metrics
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+
+
+# Resolves the sender's user row, plan and balance once per update and passes
+# them to handlers as db_user, plan and balance
+class IdentityMiddleware(BaseMiddleware):
+    def __init__(self, db):
+        self.db = db
+
+    async def __call__(self, handler, event, data):
+        from_user = data.get("event_from_user")
+        if from_user is not None:
+            user, balance = await self.db.get_identity(from_user.id)
+            data["db_user"] = user
+            data["plan"] = user.plan if user else None
+            data["balance"] = balance
+        return await handler(event, data)
+
+
+# Inner middleware: runs once the handler is resolved, so the time is
+# attributed to the handler function and the plan set by IdentityMiddleware
+class HandlerMetricsMiddleware(BaseMiddleware):
+    async def __call__(self, handler, event, data):
+        handler_object = data.get("handler")
+        name = handler_object.callback.__name__ if handler_object else "unknown"
+        plan = data.get("plan") or "none"
+        started = time.monotonic()
+        status = "error"
+        try:
+            result = await handler(event, data)
+            status = "ok"
+            return result
+        finally:
+            metrics.updates.labels(name, plan, status).observe(
+                time.monotonic() - started
+            )
+
+
+# Times every Bot API call made through the bot's session
+class TelegramMetricsMiddleware(BaseRequestMiddleware):
+    async def __call__(self, make_request, bot, method):
+        started = time.monotonic()
+        status = "error"
+        try:
+            result = await make_request(bot, method)
+            status = "ok"
+            return result
+        finally:
+            metrics.telegram_requests.labels(method.__api_method__, status).observe(
+                time.monotonic() - started
+            )
@@ -0,0 +1,36 @@
+import hashlib
+import json
+import re
+from typing import NamedTuple
+
+VK_ID_PATTERN = re.compile(r"account: (-?\d+)")
+
+
+class Post(NamedTuple):
+    text: str
+    date: int
+
+
+# Parser returns {"success": "... account: <id>", "posts": {"post1": {...}}};
+# posts come back newest first
+def parse_result(result: str):
+    data = json.loads(result)
+    match = VK_ID_PATTERN.search(data.get("success", ""))
+    vk_id = int(match.group(1)) if match else None
+    posts = [
+        Post(post.get("text") or "", post.get("date") or 0)
+        for post in (data.get("posts") or {}).values()
+    ]
+    posts.sort(key=lambda post: post.date, reverse=True)
+    return vk_id, posts
+
+
+# Number of posts on the wall, when the parser was asked for a page
+def parse_total(result: str):
+    return json.loads(result).get("total") or 0
+
+
+# kind separates reports built from the same posts in different modes
+def posts_digest(posts: list, kind: str = None):
+    payload = json.dumps(posts if kind is None else [kind, posts], ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
@@ -0,0 +1,210 @@
+import asyncio
+import collections
+import itertools
+import time
+
+import metrics
+from aiogram.exceptions import TelegramRetryAfter
+from utils.streaming import MESSAGE_LIMIT
+
+INTERACTIVE = 0
+BULK = 1
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BULK: "bulk"}
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def delay(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class OutgoingText:
+    def __init__(self, text: str, priority: int, reply_markup, coalesce: bool):
+        self.text = text
+        self.priority = priority
+        self.reply_markup = reply_markup
+        self.coalesce = coalesce
+        self.future = asyncio.get_running_loop().create_future()
+        self.attempts = 0
+
+
+# Single path for outgoing texts. Chats wait in a priority queue (interactive
+# replies before bulk notifications); a chat has at most one message in
+# flight, so its texts keep their order, and texts that pile up behind it are
+# merged into one sendMessage, unless posted with coalesce=False (a message
+# that is edited later must hold only its own text). Global and per-chat token buckets keep us under
+# Telegram's limits and a RetryAfter pauses the chat instead of failing.
+class OutboundSender:
+    def __init__(
+        self,
+        bot,
+        global_rate: float,
+        chat_rate: float,
+        chat_burst: int,
+        concurrency: int,
+        max_retries: int = 5,
+    ):
+        self.bot = bot
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.concurrency = concurrency
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._buckets = {}
+        self._paused = {}
+        self._busy = set()
+        self._queue = asyncio.PriorityQueue()
+        self._order = itertools.count()
+        self._tasks = []
+
+    async def start(self):
+        self._tasks = [
+            asyncio.create_task(self._run()) for _ in range(self.concurrency)
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # Queues a text and returns a future with the sent Message
+    def post(
+        self,
+        chat_id: int,
+        text: str,
+        priority: int = INTERACTIVE,
+        reply_markup=None,
+        coalesce: bool = True,
+    ):
+        item = OutgoingText(text, priority, reply_markup, coalesce)
+        self._chats.setdefault(chat_id, collections.deque()).append(item)
+        self._schedule(chat_id, priority)
+        metrics.outbound_queue_depth.inc()
+        item.future.add_done_callback(self._report)
+        return item.future
+
+    async def send(
+        self,
+        chat_id: int,
+        text: str,
+        priority: int = INTERACTIVE,
+        reply_markup=None,
+        coalesce: bool = True,
+    ):
+        return await self.post(chat_id, text, priority, reply_markup, coalesce)
+
+    def _report(self, future: asyncio.Future):
+        metrics.outbound_queue_depth.dec()
+        if not future.cancelled() and future.exception() is not None:
+            print(future.exception())
+
+    def _count(self, item: OutgoingText, outcome: str):
+        metrics.outbound_messages.labels(PRIORITY_NAMES[item.priority], outcome).inc()
+
+    def _schedule(self, chat_id: int, priority: int, delay: float = 0):
+        entry = (priority, next(self._order), chat_id)
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, entry)
+        else:
+            self._queue.put_nowait(entry)
+
+    def _bucket(self, chat_id: int):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) > 10000:
+                self._prune()
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    # Full buckets carry no state worth keeping
+    def _prune(self):
+        for chat_id, bucket in list(self._buckets.items()):
+            if bucket.delay() == 0 and bucket.tokens >= bucket.capacity:
+                del self._buckets[chat_id]
+
+    def _take_batch(self, pending: collections.deque):
+        batch = [pending.popleft()]
+        length = len(batch[0].text)
+        while pending and batch[-1].reply_markup is None and batch[-1].coalesce:
+            following = pending[0]
+            if not following.coalesce:
+                break
+            if length + 2 + len(following.text) > MESSAGE_LIMIT:
+                break
+            batch.append(pending.popleft())
+            length += 2 + len(following.text)
+        return batch
+
+    async def _run(self):
+        while True:
+            # Wait for global capacity before picking, so the most urgent chat
+            # that is ready at that moment gets the slot
+            while (wait := self._global.delay()) > 0:
+                await asyncio.sleep(wait)
+            priority, _, chat_id = await self._queue.get()
+            pending = self._chats.get(chat_id)
+            # Stale entry: the chat was drained or is being served
+            if not pending or chat_id in self._busy:
+                continue
+
+            wait = max(
+                self._paused.get(chat_id, 0) - time.monotonic(),
+                self._bucket(chat_id).delay(),
+            )
+            if wait > 0:
+                self._schedule(chat_id, priority, wait)
+                continue
+
+            self._busy.add(chat_id)
+            self._global.take()
+            self._bucket(chat_id).take()
+            try:
+                await self._deliver(chat_id, self._take_batch(pending))
+            finally:
+                self._busy.discard(chat_id)
+                if pending:
+                    self._schedule(chat_id, min(item.priority for item in pending))
+                else:
+                    self._chats.pop(chat_id, None)
+                    self._paused.pop(chat_id, None)
+
+    async def _deliver(self, chat_id: int, batch: list):
+        try:
+            message = await self.bot.send_message(
+                chat_id,
+                "\n\n".join(item.text for item in batch),
+                reply_markup=batch[-1].reply_markup,
+            )
+        except TelegramRetryAfter as e:
+            self._paused[chat_id] = time.monotonic() + e.retry_after
+            retry = [item for item in batch if item.attempts < self.max_retries]
+            for item in batch:
+                item.attempts += 1
+                self._count(item, "retried" if item in retry else "failed")
+                if item not in retry:
+                    item.future.set_exception(e)
+            self._chats[chat_id].extendleft(reversed(retry))
+            return
+        except Exception as e:
+            for item in batch:
+                self._count(item, "failed")
+                item.future.set_exception(e)
+            return
+
+        for index, item in enumerate(batch):
+            self._count(item, "coalesced" if index else "sent")
+            item.future.set_result(message)
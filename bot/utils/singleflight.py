@@ -0,0 +1,29 @@
+import asyncio
+from urllib.parse import urlsplit
+
+
+def normalize_link(link: str):
+    parts = urlsplit(link.strip().lower())
+    host = parts.netloc.removeprefix("www.").removeprefix("m.")
+    return f"{host}{parts.path.rstrip('/')}"
+
+
+# Concurrent calls with the same key share one underlying coroutine
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+
+    async def do(self, key, func, *args):
+        future = self._calls.get(key)
+        if future is None:
+            future = asyncio.ensure_future(func(*args))
+            self._calls[key] = future
+            future.add_done_callback(lambda done: self._forget(key, done))
+        # Shielded so one cancelled waiter does not cancel the others
+        return await asyncio.shield(future)
+
+    def _forget(self, key, future):
+        if self._calls.get(key) is future:
+            del self._calls[key]
+        if not future.cancelled():
+            future.exception()
@@ -0,0 +1,48 @@
+import asyncio
+import time
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+
+MESSAGE_LIMIT = 4096
+
+
+# Progressively edits one message, at most once per interval seconds, so a
+# streamed report stays within Telegram's edit rate limits
+class ThrottledEditor:
+    def __init__(self, bot, chat_id: int, message_id: int, interval: float):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.interval = interval
+        self._text = None
+        self._next_edit = 0.0
+
+    async def _edit(self, text: str):
+        text = text[:MESSAGE_LIMIT]
+        if text == self._text:
+            return
+        try:
+            await self.bot.edit_message_text(
+                text, chat_id=self.chat_id, message_id=self.message_id
+            )
+        except TelegramBadRequest as e:
+            # "message is not modified" is harmless, anything else is not
+            if "not modified" not in str(e):
+                raise
+        self._text = text
+        self._next_edit = time.monotonic() + self.interval
+
+    async def update(self, text: str):
+        if not text.strip() or time.monotonic() < self._next_edit:
+            return
+        try:
+            await self._edit(text)
+        except TelegramRetryAfter as e:
+            self._next_edit = time.monotonic() + e.retry_after
+
+    async def finish(self, text: str):
+        while True:
+            try:
+                return await self._edit(text)
+            except TelegramRetryAfter as e:
+                await asyncio.sleep(e.retry_after)
@@ -0,0 +1,106 @@
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class JobWorkerPool:
+    def __init__(
+        self,
+        db,
+        handler,
+        on_exhausted,
+        concurrency: int,
+        poll_interval: float,
+        lease: int,
+        max_attempts: int,
+    ):
+        self.db = db
+        self.handler = handler
+        self.on_exhausted = on_exhausted
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.lease = lease
+        self.max_attempts = max_attempts
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    def notify(self):
+        self._wakeup.set()
+
+    async def start(self):
+        self._tasks = [
+            asyncio.create_task(self._run()) for _ in range(self.concurrency)
+        ]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _wait_for_jobs(self):
+        self._wakeup.clear()
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+        except asyncio.TimeoutError:
+            pass
+
+    # Long jobs (batches, deep analyses) keep their lease while still running
+    async def _extend_lease(self, job_id: int):
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                await self.db.extend_job(job_id, self.lease)
+            except Exception:
+                logger.exception("could not extend the lease of job %s", job_id)
+
+    # Jobs whose process died or whose lease ran out max_attempts times are
+    # never claimed again; they are failed here and handed to on_exhausted
+    async def _fail_exhausted(self):
+        for job in await self.db.fail_exhausted_jobs(self.max_attempts):
+            try:
+                await self.on_exhausted(job)
+            except Exception:
+                logger.exception("could not report exhausted job %s", job.id)
+
+    async def _run(self):
+        while True:
+            try:
+                job = await self.db.claim_job(self.lease, self.max_attempts)
+            except Exception:
+                logger.exception("could not claim a job")
+                await asyncio.sleep(self.poll_interval)
+                continue
+
+            if job is None:
+                try:
+                    await self._fail_exhausted()
+                except Exception:
+                    logger.exception("could not fail exhausted jobs")
+                await self._wait_for_jobs()
+                continue
+
+            heartbeat = asyncio.create_task(self._extend_lease(job.id))
+            try:
+                await self.handler(job)
+                error = None
+            except asyncio.CancelledError:
+                # Shutdown: hand the job back so the next process picks it up
+                await asyncio.shield(self.db.release_job(job.id))
+                raise
+            except Exception as e:
+                logger.exception("job %s failed", job.id)
+                error = str(e)
+            finally:
+                heartbeat.cancel()
+
+            # A database hiccup here must not end the worker; the job's lease
+            # runs out and it is claimed again
+            try:
+                if error is None:
+                    await self.db.complete_job(job.id)
+                else:
+                    await self.db.fail_job(job.id, error)
+            except Exception:
+                logger.exception("could not record the result of job %s", job.id)
@@ -13,6 +13,11 @@ import (
 	"strings"
 )
 
+const (
+	defaultPostsCount = 5
+	maxPostsCount     = 100
+)
+
 func loadEnv() {
 	err := godotenv.Load()
 	if err != nil {
@@ -85,8 +90,8 @@ func getGroups(userID, token string) (bool, GroupInfoResponse) {
 	return false, GroupInfoResponse{}
 }
 
-func getPosts(userID, token string) (bool, WallResponse) {
-	url := fmt.Sprintf("https://api.vk.com/method/wall.get?owner_id=%s&count=5&access_token=%s&v=5.131", userID, token)
+func getPosts(userID, token string, count, offset int) (bool, WallResponse) {
+	url := fmt.Sprintf("https://api.vk.com/method/wall.get?owner_id=%s&count=%d&offset=%d&access_token=%s&v=5.131", userID, count, offset, token)
 	resp, err := http.Get(url)
 	if err != nil {
 		fmt.Println("Error:", err)
@@ -150,13 +155,15 @@ func getUserID(username, token string) (string, error) {
 
 type ResultJSON struct {
 	Success string          `json:"success"`
+	Total   int             `json:"total"`
 	Posts   map[string]Post `json:"posts"`
 }
 
-func finalMarshal(wall WallResponse, success string) ResultJSON {
+func finalMarshal(wall WallResponse, success string, offset int) ResultJSON {
 	posts := make(map[string]Post)
+	// Номера постов продолжаются между страницами, чтобы их можно было склеить
 	for i, post := range wall.Response.Items {
-		posts[fmt.Sprintf("post%d", i+1)] = Post{
+		posts[fmt.Sprintf("post%d", offset+i+1)] = Post{
 			Text: post.Text,
 			Date: post.Date,
 		}
@@ -164,6 +171,7 @@ func finalMarshal(wall WallResponse, success string) ResultJSON {
 
 	resultJSON := ResultJSON{
 		Success: success,
+		Total:   wall.Response.Count,
 		Posts:   posts,
 	}
 	return resultJSON
@@ -219,7 +227,20 @@ func ParseHandler(w http.ResponseWriter, r *http.Request) {
 		log.Fatal(err)
 	}
 
-	isPosts, posts := getPosts(userID, token)
+	// VK отдаёт не больше 100 постов за один вызов wall.get
+	count := req.Count
+	if count <= 0 {
+		count = defaultPostsCount
+	}
+	if count > maxPostsCount {
+		count = maxPostsCount
+	}
+	offset := req.Offset
+	if offset < 0 {
+		offset = 0
+	}
+
+	isPosts, posts := getPosts(userID, token, count, offset)
 	//isGroups, groups := getGroups(userID, token)
 	var success string
 	if isPosts {
@@ -230,7 +251,7 @@ func ParseHandler(w http.ResponseWriter, r *http.Request) {
 		log.Println("Cannot receive data from account: " + userID)
 	}
 
-	resultJSON := finalMarshal(posts, success)
+	resultJSON := finalMarshal(posts, success, offset)
 	resultJSONStr, err := json.Marshal(resultJSON)
 
 	if err != nil {
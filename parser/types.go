@@ -7,6 +7,7 @@ type Post struct {
 
 type WallResponse struct {
 	Response struct {
+		Count int    `json:"count"`
 		Items []Post `json:"items"`
 	} `json:"response"`
 }
@@ -28,7 +29,9 @@ type GroupInfoResponse struct {
 }
 
 type ParseRequest struct {
-	Link string `json:"link"`
+	Link   string `json:"link"`
+	Count  int    `json:"count"`
+	Offset int    `json:"offset"`
 }
 
 type ParseResponse struct {